@@ -0,0 +1,94 @@
+#%%
+
+### Model build scaling benchmark ###
+# Times prepare_optimization_data and build_model on synthetic fleets of
+# increasing size. With the (hour -> EVs present) index the build time per
+# EV-hour pair should stay roughly constant as the fleet grows.
+# run_prep_benchmark times the vectorized EV preprocessing on its own.
+
+import sys
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+import pandas as pd
+from src.optimization_model import prepare_optimization_data, build_model
+from src.utils import MARKET_TZ
+
+
+def make_synthetic_inputs(n_ev_per_day, n_days=9, seed=0):
+    rng = np.random.default_rng(seed)
+
+    timestamps = pd.date_range("2024-12-23", periods=n_days*24, freq="h", tz=MARKET_TZ, name='timestamp')
+    n_hours = len(timestamps)
+
+    df_fc = pd.DataFrame({
+        'forecasted_prices': 80 + 30*np.sin(np.arange(n_hours)/24*2*np.pi),
+        'solar_generation': rng.uniform(0, 2000, n_hours),
+        'wind_on_generation': rng.uniform(500, 3000, n_hours),
+        'wind_off_generation': rng.uniform(200, 2000, n_hours),
+        'fossil_hard_coal_generation': rng.uniform(500, 1500, n_hours),
+        'fossil_gas_generation': rng.uniform(2000, 5000, n_hours),
+    }, index=timestamps)
+
+    sim_start = timestamps[0]
+    sim_end = timestamps[-1]
+
+    n_ev = n_ev_per_day*n_days
+    dates = np.repeat(timestamps[::24], n_ev_per_day)
+    toa = dates + pd.to_timedelta(rng.integers(0, 24*60, n_ev), unit='min')
+    tod = toa + pd.to_timedelta(rng.integers(60, 48*60, n_ev), unit='min')
+
+    df_ev = pd.DataFrame({
+        'ev_id': [f'V{i+1}' for i in np.tile(np.arange(n_ev_per_day), n_days)],
+        'toa': pd.Series(toa).clip(sim_start, sim_end),
+        'tod': pd.Series(tod).clip(sim_start, sim_end),
+        'i_soc': rng.integers(10, 50, n_ev),
+        'd_soc': rng.integers(70, 100, n_ev),
+        'max_battery_capacity': rng.choice([40, 60, 75, 100], n_ev),
+        'date': dates,
+    })
+
+    return df_ev, df_fc
+
+
+def run_benchmark(fleet_sizes=(250, 500, 1000, 2000)):
+    rows = []
+    for n_ev_per_day in fleet_sizes:
+        df_ev, df_fc = make_synthetic_inputs(n_ev_per_day)
+
+        t0 = perf_counter()
+        opt_data = prepare_optimization_data(df_ev, df_fc)
+        t1 = perf_counter()
+        build_model(opt_data)
+        t2 = perf_counter()
+
+        n_pairs = len(opt_data['pair_t'])
+        rows.append({
+            'ev_per_day': n_ev_per_day,
+            'n_ev': len(opt_data['EV_list']),
+            'ev_hour_pairs': n_pairs,
+            'prep_s': round(t1 - t0, 3),
+            'build_s': round(t2 - t1, 3),
+            'build_us_per_pair': round((t2 - t1)/n_pairs*1e6, 2),
+        })
+        print(rows[-1])
+
+    return pd.DataFrame(rows)
+
+
+def run_prep_benchmark(n_sessions=100_000, n_days=9):
+    df_ev, df_fc = make_synthetic_inputs(n_sessions // n_days, n_days)
+
+    t0 = perf_counter()
+    opt_data = prepare_optimization_data(df_ev, df_fc)
+    t1 = perf_counter()
+
+    print(f"Preprocessed {len(df_ev)} EV sessions ({len(opt_data['pair_t'])} EV-hour pairs) in {t1 - t0:.3f} s")
+
+
+if __name__ == '__main__':
+    print(run_benchmark().to_string(index=False))
+    run_prep_benchmark()
@@ -0,0 +1,56 @@
+#%%
+
+### Stochastic bidding scaling benchmark ###
+# Times launch_stochastic_optimization on the week-long synthetic case for an
+# increasing number of price scenarios. Each scenario adds a copy of the
+# per-EV charging model to the LP, so this is where the solve time of the
+# stochastic mode goes.
+
+import sys
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+import pandas as pd
+from src.optimization_model import launch_stochastic_optimization
+from benchmarks.model_build_benchmark import make_synthetic_inputs
+
+
+def make_price_scenarios(df_fc, n_scenarios, seed=0):
+    rng = np.random.default_rng(seed)
+    noise = rng.normal(0, 15, (len(df_fc), n_scenarios))
+
+    return pd.DataFrame(
+        df_fc['forecasted_prices'].to_numpy()[:, None] + noise,
+        index=df_fc.index,
+        columns=[f'scenario_{i}' for i in range(n_scenarios)],
+    )
+
+
+def run_benchmark(scenario_counts=(5, 20, 50), n_ev_per_day=300):
+    df_ev, df_fc = make_synthetic_inputs(n_ev_per_day)
+
+    rows = []
+    for n_scenarios in scenario_counts:
+        scenarios = make_price_scenarios(df_fc, n_scenarios)
+
+        t0 = perf_counter()
+        summary = launch_stochastic_optimization(df_ev, df_fc, scenarios)
+        t1 = perf_counter()
+
+        rows.append({
+            'scenarios': n_scenarios,
+            'solve_s': round(t1 - t0, 2),
+            'solve_s_per_scenario': round((t1 - t0)/n_scenarios, 2),
+            'expected_cost': round(summary['expected_cost'], 2),
+            'expected_num_ev_tardy': summary['expected_num_ev_tardy'],
+        })
+        print(rows[-1])
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    print(run_benchmark().to_string(index=False))
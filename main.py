@@ -9,95 +9,120 @@ from time import sleep
 import warnings
 warnings.filterwarnings("ignore")
 
+# The pipeline runs from main() under the `if __name__ == "__main__":` guard at
+# the bottom. Raw file parsing and parameter tuning use process pools, and
+# under spawn/forkserver every pool worker re-imports this file (as
+# "__mp_main__"), so nothing below may run at import time.
+
 ### Loading Raw Data into Variables ###
 
-print('Step 1 - Loading, Cleaning, and Merging Raw Data into a Processed Data File', '\n')
+def load_data():
+    print('Step 1 - Loading, Cleaning, and Merging Raw Data into a Processed Data File', '\n')
+
+    processed_data = load_raw_data()
 
-processed_data = load_raw_data()
+    sleep(5)
 
-sleep(5)
+    print('Step 1 Finished! Raw Data Loaded!', '\n')
 
-print('Step 1 Finished! Raw Data Loaded!', '\n')
 
+    print('--------------------------------------------------', '\n')
 
-print('--------------------------------------------------', '\n')
+    return processed_data
 
 ### Performing Data Quality Checks, Cleaning, and Combining them into a single Processed File ###
 
 #%%
-print('Step 2 - Exporting Processed Data into a CSV File', '\n')
+def export_data(processed_data):
+    print('Step 2 - Exporting Processed Data into a CSV File', '\n')
 
-#processed_data = process_raw_data(raw_load_data, raw_price_data)
-#print(processed_data)
+    #processed_data = process_raw_data(raw_load_data, raw_price_data)
+    #print(processed_data)
 
-print(export_processed_data(processed_data))
-print(processed_data.head())
+    print(export_processed_data(processed_data))
+    print(processed_data.head())
 
-sleep(5)
+    sleep(5)
 
-print('Step 2 Finished! Raw Data Cleaned and Processed Data!', '\n')
+    print('Step 2 Finished! Raw Data Cleaned and Processed Data!', '\n')
 
-print('--------------------------------------------------', '\n')
+    print('--------------------------------------------------', '\n')
 
 
 ### Performing Day Ahead Price Forecasting ###
 
-from src.data_forecasting import *
+def forecast_prices(processed_data, no_of_days_to_forecast=9):
+    print(f'Step 3 - Day Ahead Price Forecasting for {no_of_days_to_forecast} days!', '\n')
 
-no_of_days_to_forecast = 9
+    # Currently tuning parameters are already set based on some pretesting, if you'd like to play around with the no of days and get optimized forecasting results, set the tuning_required parameter to True.
 
-print(f'Step 3 - Day Ahead Price Forecasting for {no_of_days_to_forecast} days!', '\n')
+    split_point, df_forecasted = perform_forecasting(processed_data, no_of_days_to_forecast, tuning_required=False)
 
-# Currently tuning parameters are already set based on some pretesting, if you'd like to play around with the no of days and get optimized forecasting results, set the tuning_required parameter to True.
+    sleep(2)
 
-split_point, df_forecasted = perform_forecasting(processed_data, no_of_days_to_forecast, tuning_required=False)
+    print('Step 3 Finished! Day Ahead Price Forecasting Completed!', '\n')
 
-sleep(2)
+    print('--------------------------------------------------', '\n')
 
-print('Step 3 Finished! Day Ahead Price Forecasting Completed!', '\n')
-
-print('--------------------------------------------------', '\n')
+    return df_forecasted
 
 
 ### Generating EV data for a week ###
 
-print('Step 4 - Fetching EV data', '\n')
+def fetch_ev_data(df_forecasted):
+    print('Step 4 - Fetching EV data', '\n')
+
+    df_ev_data, df_forecasted = modify_ev_data(df_forecasted)
 
-df_ev_data, df_forecasted = modify_ev_data(df_forecasted)
+    sleep(2)
 
-sleep(2)
+    print('Step 4 Finished! EV Data Fetched!', '\n')
 
-print('Step 4 Finished! EV Data Fetched!', '\n')
+    print('--------------------------------------------------', '\n')
 
-print('--------------------------------------------------', '\n')
+    return df_ev_data, df_forecasted
 
 
 ### Running the Optimization Model for a week ###
 
-print('Step 5 - Optimization', '\n')
+def optimize(df_ev_data, df_forecasted):
+    print('Step 5 - Optimization', '\n')
 
-print('Forecasting Horizon - 23rd December 2024 -> 31st December 2024 | 9 days. \n')
-print('Optimization Horizon - 24th December 2024 -> 30th December 2024 | 1 week. \n')
-print('Reason: To take into account the initial EV data warmup and avoid pile up of EVs that have not reached their departure times by the end of optimization horizon (Observe the number of departures on 31st December). \n')
+    print('Forecasting Horizon - 23rd December 2024 -> 31st December 2024 | 9 days. \n')
+    print('Optimization Horizon - 24th December 2024 -> 30th December 2024 | 1 week. \n')
+    print('Reason: To take into account the initial EV data warmup and avoid pile up of EVs that have not reached their departure times by the end of optimization horizon (Observe the number of departures on 31st December). \n')
 
-#sleep(1)
+    #sleep(1)
 
-print('Launching Optimization Model!!', '\n')
+    print('Launching Optimization Model!!', '\n')
 
-#df_opti_data = launch_optimization(df_ev_data, df_forecasted)
+    #df_opti_data = launch_optimization(df_ev_data, df_forecasted)
 
-#sleep(1)
+    #sleep(1)
 
-summary = launch_optimization(df_ev_data, df_forecasted)
+    summary = launch_optimization(df_ev_data, df_forecasted)
 
-print("\n=== Optimization Summary ===")
-print("Total Charging Cost:", summary["total_charging_cost"])
-print("EVs not fully charged:", summary["num_ev_tardy"])
+    print("\n=== Optimization Summary ===")
+    print("Total Charging Cost:", summary["total_charging_cost"])
+    print("EVs not fully charged:", summary["num_ev_tardy"])
 
 
-print('Step 5 Finished! Day Ahead Bids Optimized!', '\n')
+    print('Step 5 Finished! Day Ahead Bids Optimized!', '\n')
 
-print('--------------------------------------------------', '\n')
+    print('--------------------------------------------------', '\n')
 
+    return summary
 
 
+def main():
+    processed_data = load_data()
+    export_data(processed_data)
+    df_forecasted = forecast_prices(processed_data)
+    df_ev_data, df_forecasted = fetch_ev_data(df_forecasted)
+    return optimize(df_ev_data, df_forecasted)
+
+
+#%%
+
+if __name__ == "__main__":
+    summary = main()
@@ -1,12 +1,67 @@
 from .utils import *
 import pandas as pd
+import numpy as np
+import re
 import plotly.graph_objects as go
 
+
+### ENTSO-E MTU timestamp parser ###
+# MTU strings have a fixed layout, "dd/mm/yyyy HH:MM[:SS] - dd/mm/yyyy HH:MM[:SS]"
+# followed by " (CET)" / " (CEST)" in the CET/CEST exports. Only the start of
+# the period is read, by character position, and truncated to the hour. The
+# CET/CEST suffix gives the UTC offset, so the repeated hour at the end of
+# summer time stays two distinct hours. Each distinct string is converted
+# once (generation files repeat every MTU once per production type).
+# Returns a tz-aware DatetimeIndex in MARKET_TZ.
+
+MTU_OFFSET_HOURS = {b"(CET)": 1, b"(CEST)": 2}
+
+
+def parse_mtu_hour(values, utc=False):
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    raw = np.array(uniques, dtype="S")
+
+    chars = raw.view(np.uint8).reshape(len(raw), -1)
+    if chars.shape[1] < 13:
+        raise ValueError("Unexpected MTU timestamp layout, expected 'dd/mm/yyyy HH:MM'.")
+
+    separators = chars[:, [2, 5, 10]]
+    if (chars[:, :13] == 0).any() or ((separators >= ord("0")) & (separators <= ord("9"))).any():
+        raise ValueError("Unexpected MTU timestamp layout, expected 'dd/mm/yyyy HH:MM'.")
+
+    digits = chars.astype(np.int64) - ord("0")
+    day = digits[:, 0]*10 + digits[:, 1]
+    month = digits[:, 3]*10 + digits[:, 4]
+    year = digits[:, 6]*1000 + digits[:, 7]*100 + digits[:, 8]*10 + digits[:, 9]
+    hour = digits[:, 11]*10 + digits[:, 12]
+
+    months = ((year - 1970)*12 + month - 1).astype("datetime64[M]")
+    local = months.astype("datetime64[D]") + (day - 1) + hour.astype("timedelta64[h]")
+
+    if utc:
+        stamps = pd.DatetimeIndex(local.astype("datetime64[ns]")).tz_localize("UTC")
+    else:
+        offset = np.full(len(raw), -1)
+        for suffix, hours in MTU_OFFSET_HOURS.items():
+            offset[np.char.endswith(raw, suffix)] = hours
+
+        if (offset < 0).all():
+            # no CET/CEST suffix, repeated autumn hour is read as winter time
+            stamps = pd.DatetimeIndex(local.astype("datetime64[ns]")).tz_localize(MARKET_TZ, ambiguous=False, nonexistent="shift_forward")
+        elif (offset < 0).any():
+            raise ValueError("MTU timestamps mix entries with and without a CET/CEST suffix.")
+        else:
+            stamps = pd.DatetimeIndex((local - offset.astype("timedelta64[h]")).astype("datetime64[ns]")).tz_localize("UTC")
+
+    return stamps.tz_convert(MARKET_TZ)[codes].rename("timestamp")
+
+
 ### Function for Cleaning Raw Load Data, mainly the timestamp ###
 
 def transform_load_data(name_of_file):
     temp_df = pd.read_csv(name_of_file)
-    if 'MTU (UTC)' in temp_df.columns.tolist():
+    is_utc = 'MTU (UTC)' in temp_df.columns.tolist()
+    if is_utc:
         temp_df = temp_df.rename(
             columns={
                 'Actual Total Load (MW)': 'DA_actual_load', 
@@ -24,9 +79,7 @@ def transform_load_data(name_of_file):
         )
     temp_df = temp_df.drop(columns=({'Area'}))
     
-    temp_df['timestamp'] = temp_df['timestamp'].replace(r'\s*\(CET\)|\s*\(CEST\)', '', regex=True)
-    temp_df['timestamp'] = temp_df['timestamp'].replace(r':.*','',regex=True)
-    temp_df['timestamp'] = pd.to_datetime(temp_df['timestamp'], dayfirst=True).dt.strftime('%Y-%m-%d %H')
+    temp_df['timestamp'] = parse_mtu_hour(temp_df['timestamp'], utc=is_utc)
 
     df_temp = pd.DataFrame(temp_df.groupby('timestamp').agg(
         actual_load=('DA_actual_load','sum'),
@@ -37,56 +90,56 @@ def transform_load_data(name_of_file):
 
 
 ### Function for Renewable Energy Generation Transformation ###
+# The generation export has one row per (MTU, production type). The file is
+# read once (only the three needed columns), the generation values are made
+# numeric in one pass and the long table is unstacked into one column per
+# production type, so every value lands on its own timestamp even if a type
+# is missing for some MTUs (those hours count as 0 MW).
+#
+# production_types selects the ENTSO-E production types to keep. Types listed
+# in GENERATION_COLUMNS keep their established column names, any other type is
+# named after its ENTSO-E label, e.g. 'Hydro Run-of-river and poundage' ->
+# 'hydro_run_of_river_and_poundage_generation'.
+
+GENERATION_COLUMNS = {
+    'Solar': 'solar_generation',
+    'Wind Onshore': 'wind_on_generation',
+    'Wind Offshore': 'wind_off_generation',
+    'Fossil Hard coal': 'fossil_hard_coal_generation',
+    'Fossil Gas': 'fossil_gas_generation',
+}
+
+DEFAULT_PRODUCTION_TYPES = tuple(GENERATION_COLUMNS)
+
+
+def generation_column(production_type):
+    if production_type in GENERATION_COLUMNS:
+        return GENERATION_COLUMNS[production_type]
+    return re.sub(r'[^0-9a-z]+', '_', production_type.lower()).strip('_') + '_generation'
+
+
+def transform_renewables_load_data(name_of_file, production_types=DEFAULT_PRODUCTION_TYPES):
+    df_rwe_data = pd.read_csv(
+        name_of_file,
+        usecols=lambda col: col in ('MTU (UTC)', 'MTU (CET/CEST)', 'Production Type', 'Generation (MW)'),
+        dtype={'Production Type': 'category'},
+    )
+    is_utc = 'MTU (UTC)' in df_rwe_data.columns.tolist()
+    timestamp_col = 'MTU (UTC)' if is_utc else 'MTU (CET/CEST)'
+
+    timestamps = parse_mtu_hour(df_rwe_data[timestamp_col], utc=is_utc)
+    generation = pd.to_numeric(df_rwe_data['Generation (MW)'], errors='coerce')
+
+    df_temp = (
+        generation
+        .groupby([timestamps, df_rwe_data['Production Type']], observed=True)
+        .sum()
+        .unstack(fill_value=0.0)
+        .reindex(columns=list(production_types), fill_value=0.0)
+    )
 
-def transform_renewables_load_data(name_of_file):
-    df_rwe_data = pd.read_csv(name_of_file)
-
-    temp_df = df_rwe_data.loc[(
-        df_rwe_data['Production Type']=='Solar'
-    )]
-    if 'MTU (UTC)' in temp_df.columns.tolist():
-        temp_df = temp_df.rename(columns={
-            'MTU (UTC)': 'timestamp',
-            'Generation (MW)': 'solar_generation'
-        })
-    else:
-        temp_df = temp_df.rename(columns={
-            'MTU (CET/CEST)': 'timestamp',
-            'Generation (MW)': 'solar_generation'
-        })
-    temp_df = temp_df.drop(columns={'Area','Production Type'})
-
-    temp_df['solar_generation'] = pd.to_numeric(temp_df['solar_generation'])
-
-    temp_df['wind_on_generation'] = list(df_rwe_data['Generation (MW)'].loc[(
-        df_rwe_data['Production Type']=='Wind Onshore'
-    )])
-
-    temp_df['wind_off_generation'] = list(df_rwe_data['Generation (MW)'].loc[(
-        df_rwe_data['Production Type']=='Wind Offshore'
-    )])
-
-    temp_df['fossil_hard_coal_generation'] = list(pd.to_numeric(df_rwe_data['Generation (MW)'].loc[(
-        df_rwe_data['Production Type']=='Fossil Hard coal'
-    )]))
-
-    temp_df['fossil_gas_generation'] = list(pd.to_numeric(df_rwe_data['Generation (MW)'].loc[(
-        df_rwe_data['Production Type']=='Fossil Gas'
-    )]))
-
-    temp_df.reset_index()
-
-    temp_df['timestamp'] = temp_df['timestamp'].replace(r'\s*\(CET\)|\s*\(CEST\)', '', regex=True)
-    temp_df['timestamp'] = temp_df['timestamp'].replace(r':.*','',regex=True)
-    temp_df['timestamp'] = pd.to_datetime(temp_df['timestamp'], dayfirst=True).dt.strftime('%Y-%m-%d %H')
-
-    df_temp = pd.DataFrame(temp_df.groupby('timestamp').agg(
-        solar_generation=('solar_generation','sum'),
-        wind_on_generation=('wind_on_generation','sum'),
-        wind_off_generation=('wind_off_generation','sum'),
-        fossil_hard_coal_generation=('fossil_hard_coal_generation','sum'),
-        fossil_gas_generation=('fossil_gas_generation','sum'),
-    ))
+    df_temp.columns = [generation_column(t) for t in production_types]
+    df_temp.index.name = 'timestamp'
 
     return df_temp
 
@@ -95,7 +148,8 @@ def transform_renewables_load_data(name_of_file):
 
 def transform_price_data(name_of_file):
     temp_df = pd.read_csv(name_of_file)
-    if 'MTU (UTC)' in temp_df.columns.tolist():
+    is_utc = 'MTU (UTC)' in temp_df.columns.tolist()
+    if is_utc:
         temp_df = temp_df.rename(
             columns={
                 'MTU (UTC)': 'timestamp', 
@@ -111,9 +165,7 @@ def transform_price_data(name_of_file):
             }
         )
         temp_df = temp_df.drop(columns={'Intraday Period (CET/CEST)', 'Intraday Price (EUR/MWh)', 'Area', 'Sequence'})
-    temp_df['timestamp'] = temp_df['timestamp'].replace(r'\s*\(CET\)|\s*\(CEST\)', '', regex=True)
-    temp_df['timestamp'] = temp_df['timestamp'].replace(r' -.*', '', regex=True)
-    temp_df['timestamp'] = pd.to_datetime(temp_df['timestamp'], dayfirst=True).dt.strftime('%Y-%m-%d %H')
+    temp_df['timestamp'] = parse_mtu_hour(temp_df['timestamp'], utc=is_utc)
 
     
 
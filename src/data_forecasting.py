@@ -6,22 +6,36 @@ from xgboost import XGBRegressor
 from xgboost import plot_importance, plot_tree
 from sklearn.metrics import root_mean_squared_error, mean_absolute_error
 import plotly.graph_objects as go
-from sklearn.model_selection import GridSearchCV
-
-
-def perform_forecasting(data, pred_no_of_days, tuning_required=False):
-    data_df = data.copy()
-    
+from .model_registry import fit_forecast_model
+from .feature_store import create_features, load_features, ex_post_columns
+import os
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+XGB_PARAMS = {
+    'objective': 'reg:squarederror',
+    'learning_rate': 0.1,
+    'n_estimators': 1000,
+    'max_depth': 7,
+    'subsample': 0.9,
+}
+
+
+# use_registry=True reuses or incrementally updates the stored model when the
+# training data is unchanged or only extended (see model_registry.py), and
+# use_feature_store=True only computes features for new hours (feature_store.py)
+def perform_forecasting(data, pred_no_of_days, tuning_required=False, use_registry=True, day_ahead=True, use_feature_store=True):
     # Adding Features for forecasting
-    data_df = create_features(data_df)
+    data_df = load_features(data, day_ahead, use_store=use_feature_store)
 
     # Train/Test Split
     pred_hours = pred_no_of_days*24
     total_hours = len(data_df['DA_Price'])
     no_of_training_data_points = int(total_hours * (1-pred_hours/total_hours))
 
-    X = data_df.drop(['DA_Price', 'date'], axis=1).copy()
-    y = data_df['DA_Price'].copy()
+    X, y = model_inputs(data_df, day_ahead)
 
     X_train = X.iloc[:no_of_training_data_points]
     X_test = X.iloc[no_of_training_data_points:]
@@ -30,18 +44,11 @@ def perform_forecasting(data, pred_no_of_days, tuning_required=False):
     y_test = y.iloc[no_of_training_data_points:]
 
     if tuning_required:
-        best_params = parameter_tuning(X_train, y_train)
-        xgb_model = XGBRegressor(**best_params)
+        params = parameter_tuning(X_train, y_train)
     else:
-        xgb_model = XGBRegressor(
-            objective='reg:squarederror', 
-            learning_rate=0.1,
-            n_estimators=1000,
-            max_depth=7,
-            subsample=0.9
-        )
-    
-    xgb_model.fit(X_train, y_train)
+        params = XGB_PARAMS
+
+    xgb_model = fit_forecast_model(X_train, y_train, params, use_registry=use_registry)
     xgb_predictions = xgb_model.predict(X_test)
 
     print('Price Forecasting Completed!','\n')
@@ -65,6 +72,18 @@ def perform_forecasting(data, pred_no_of_days, tuning_required=False):
 
 def calculate_error_metrices(xgb_predictions, y_test):
 
+    metrics = error_metrics(xgb_predictions, y_test)
+
+    print('Error Metrices:','\n')
+    print(f'MAE: {metrics["MAE"]}')
+    print(f'RMSE: {metrics["RMSE"]}')
+    print(f'sMAPE: {metrics["sMAPE"]}')
+
+
+def error_metrics(xgb_predictions, y_test):
+    y_test = np.asarray(y_test, dtype=float)
+    xgb_predictions = np.asarray(xgb_predictions, dtype=float)
+
     mae = mean_absolute_error(y_test, xgb_predictions)
     rmse = root_mean_squared_error(y_test, xgb_predictions)
 
@@ -79,47 +98,211 @@ def calculate_error_metrices(xgb_predictions, y_test):
         )*100, 2
     )
 
-    print('Error Metrices:','\n')
-    print(f'MAE: {mae}')
-    print(f'RMSE: {rmse}')
-    print(f'sMAPE: {smape}')
+    return {'MAE': mae, 'RMSE': rmse, 'sMAPE': smape}
+
+
+### Model inputs ###
+# Actual load and generation are only known after delivery and are left out
+# of the day-ahead inputs. The model sees their D-1 values from before the
+# gate closure instead (feature_store.day_ahead_fundamental_features). forecast_load is the
+# day-ahead load forecast and stays in.
+
+
+# model inputs and target of a create_features frame
+def model_inputs(data_df, day_ahead=True):
+    drop = ['DA_Price', 'date'] + (ex_post_columns(data_df) if day_ahead else [])
+    return data_df.drop(drop, axis=1), data_df['DA_Price']
+
+
+### Hyperparameter search ###
+# Successive halving over TUNING_PARAM_GRID: every candidate is first scored
+# with a small boosting budget, only the best 1/halving_factor survive to the
+# next rung, and the budget grows by halving_factor until max_rounds. Scores
+# are the mean validation RMSE over expanding-window time series folds (the
+# model never sees hours after its validation block), with early stopping on
+# the validation block. n_candidates > 0 draws a random subset of the grid
+# first (random search) instead of starting from the full grid.
+#
+# Each rung is evaluated in a process pool. The training data is shipped to
+# every worker once through the pool initializer, and the cores are split
+# between pool workers and XGBoost threads. Call from under
+# `if __name__ == "__main__":` in scripts (main.py runs its pipeline from
+# main()), the process pool re-imports the main module under spawn and
+# forkserver. A pool worker that reaches parameter_tuning through an
+# unguarded main module tunes serially instead of starting pools of its own.
+#
+# Returns the best parameters with n_estimators set from early stopping.
+
+TUNING_PARAM_GRID = {
+    'learning_rate': [0.01, 0.1, 0.25, 0.5, 1],
+    'max_depth': [3, 5, 7],
+    'subsample': [0.8, 0.9, 1.0],
+    'objective': ['reg:squarederror'],
+}
+
+_tuning_data = None
+
+
+def parameter_tuning(xtrain, ytrain, param_grid=None, n_splits=3, validation_days=14, max_rounds=1000,
+                     halving_factor=3, n_rungs=3, early_stopping_rounds=50, n_candidates=None, seed=0, n_workers=None):
+
+    grid = param_grid or TUNING_PARAM_GRID
+    keys = list(grid)
+    candidates = [dict(zip(keys, values)) for values in itertools.product(*grid.values())]
+
+    if n_candidates and n_candidates < len(candidates):
+        picks = np.random.default_rng(seed).choice(len(candidates), size=n_candidates, replace=False)
+        candidates = [candidates[i] for i in np.sort(picks)]
+
+    folds = time_series_folds(len(xtrain), n_splits, validation_days*24)
+
+    n_cpu = os.cpu_count()
+    if multiprocessing.parent_process() is not None:
+        n_workers = 1
+
+    shared = (xtrain.to_numpy(dtype=np.float32), ytrain.to_numpy(dtype=np.float64), folds, early_stopping_rounds)
+
+    print(f'Tuning {len(candidates)} candidates on {len(folds)} time series folds \n')
+
+    for rung in range(n_rungs):
+        rounds = max(int(max_rounds / halving_factor**(n_rungs - 1 - rung)), 1)
+
+        workers = min(n_workers or n_cpu, len(candidates))
+        threads = max(n_cpu // workers, 1)
+        jobs = [({**params, 'n_jobs': threads}, rounds) for params in candidates]
+
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_tuning_worker, initargs=(shared,)) as pool:
+                results = list(pool.map(_score_candidate, jobs))
+        else:
+            _init_tuning_worker(shared)
+            results = [_score_candidate(job) for job in jobs]
+
+        order = np.argsort([rmse for rmse, _ in results], kind='stable')
+        best_rmse, best_rounds = results[order[0]]
+        print(f'Rung {rung + 1}/{n_rungs}: {len(candidates)} candidates x {rounds} rounds, best RMSE {best_rmse:.3f}')
+
+        if rung == n_rungs - 1:
+            break
 
+        n_keep = max(len(candidates) // halving_factor, 1)
+        candidates = [candidates[i] for i in order[:n_keep]]
 
-def create_features(df):
-    # time based features
+    best_params = {**candidates[order[0]], 'n_estimators': best_rounds}
+    print(f'Best parameters: {best_params} \n')
+
+    return best_params
+
+
+# expanding-window folds, each validated on the validation_hours after its training block
+def time_series_folds(n_rows, n_splits, validation_hours):
+    if n_rows <= n_splits*validation_hours:
+        raise ValueError("Training data is too short for the requested number of validation folds.")
+
+    ends = n_rows - validation_hours*np.arange(n_splits - 1, -1, -1)
+    return [(end - validation_hours, end) for end in ends]
+
+
+def _init_tuning_worker(shared):
+    global _tuning_data
+    _tuning_data = shared
+
+
+# mean validation RMSE over the folds, and the mean early-stopped number of trees
+def _score_candidate(job):
+    params, rounds = job
+    X, y, folds, early_stopping_rounds = _tuning_data
+
+    scores = []
+    best_rounds = []
+    for val_start, val_end in folds:
+        model = XGBRegressor(**{**params, 'n_estimators': rounds, 'early_stopping_rounds': early_stopping_rounds, 'eval_metric': 'rmse'})
+        model.fit(X[:val_start], y[:val_start], eval_set=[(X[val_start:val_end], y[val_start:val_end])], verbose=False)
+        scores.append(model.best_score)
+        best_rounds.append(model.best_iteration + 1)
+
+    return float(np.mean(scores)), int(np.mean(best_rounds))
+
+
+### Price scenarios for stochastic bidding ###
+# Out-of-sample residuals of the forecaster: the model is refit on the training
+# block minus its last validation_days and evaluated on those days.
+
+def forecast_residuals(data, pred_no_of_days, validation_days=14, use_registry=True, day_ahead=True, use_feature_store=True):
+    data_df = load_features(data, day_ahead, use_store=use_feature_store)
+
+    pred_hours = pred_no_of_days*24
+    total_hours = len(data_df['DA_Price'])
+    no_of_training_data_points = int(total_hours * (1-pred_hours/total_hours))
+    split = no_of_training_data_points - validation_days*24
+
+    X, y = model_inputs(data_df, day_ahead)
+
+    xgb_model = fit_forecast_model(X.iloc[:split], y.iloc[:split], XGB_PARAMS, name='price_validation', use_registry=use_registry)
+
+    y_val = y.iloc[split:no_of_training_data_points]
+
+    return y_val - xgb_model.predict(X.iloc[split:no_of_training_data_points])
+
+
+# Scenarios = point forecast + residual blocks resampled from the residual
+# history. Blocks keep their hour of day so intraday error patterns survive.
+# The scenarios are split into chunks that are drawn in parallel, each with
+# an independent child seed, so the result only depends on seed and n_workers.
+
+def generate_price_scenarios(df_forecasted, residuals, n_scenarios=50, block_hours=24, seed=0, n_workers=None):
+    point = df_forecasted['forecasted_prices'].to_numpy(dtype=float)
+    forecast_hours = df_forecasted.index.hour.to_numpy()
+
+    residual_values = np.asarray(residuals, dtype=float)
+    residual_hours = residuals.index.hour.to_numpy()
+
+    n_workers = max(1, min(n_workers or os.cpu_count(), n_scenarios))
+    chunk_sizes = [len(c) for c in np.array_split(np.arange(n_scenarios), n_workers)]
+    seeds = np.random.SeedSequence(seed).spawn(n_workers)
+
+    args = [(point, forecast_hours, residual_values, residual_hours, size, block_hours, ss)
+            for size, ss in zip(chunk_sizes, seeds)]
+
+    if n_workers == 1:
+        chunks = [_bootstrap_scenarios(*args[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            chunks = list(pool.map(_bootstrap_scenarios, *zip(*args)))
+
+    scenarios = np.vstack(chunks)
+
+    return pd.DataFrame(
+        scenarios.T,
+        index=df_forecasted.index,
+        columns=[f'scenario_{i}' for i in range(n_scenarios)],
+    )
 
-    df['date'] = pd.to_datetime(df.index)
-    df['hour'] = df['date'].dt.hour
-    df['dayofweek'] = df['date'].dt.dayofweek
-    df['dayofmonth'] = df['date'].dt.day
-    df['dayofyear'] = df['date'].dt.dayofyear
 
-    # adding lags
-    df['lag_1h'] = df['DA_Price'].shift(1)
-    df['lag_24h'] = df['DA_Price'].shift(24)
-    df['lag_168h'] = df['DA_Price'].shift(168)
+def _bootstrap_scenarios(point, forecast_hours, residual_values, residual_hours, n_scenarios, block_hours, seed_seq):
+    rng = np.random.default_rng(seed_seq)
 
-    # adding rolling mean
-    df['rolling_mean_2h'] = df['DA_Price'].rolling(window=2).mean()
-    df['rolling_mean_3h'] = df['DA_Price'].rolling(window=3).mean()
-    df['rolling_mean_6h'] = df['DA_Price'].rolling(window=6).mean()
+    n_hours = len(point)
+    block_starts = np.arange(0, n_hours, block_hours)
 
-    return df
+    # for every hour of day, the residual positions a full block can start from
+    valid = np.arange(len(residual_values)) <= len(residual_values) - block_hours
+    starts_by_hour = [np.flatnonzero(valid & (residual_hours == h)) for h in range(24)]
 
+    picks = np.empty((n_scenarios, len(block_starts)), dtype=np.int64)
+    for b, start in enumerate(block_starts):
+        candidates = starts_by_hour[forecast_hours[start]]
+        if len(candidates) == 0:
+            raise ValueError("Residual history is shorter than one bootstrap block.")
+        picks[:, b] = rng.choice(candidates, size=n_scenarios)
 
-def parameter_tuning(xtrain, ytrain):
-    param_grid = {
-        'learning_rate': [0.01, 0.1, 0.25, 0.5, 1],
-        'max_depth': [3, 5, 7],
-        'subsample': [0.8, 0.9, 1.0],
-        'n_estimators': [1000],
-        'objective': ['reg:squarederror']
-    }
+    # residual index for every (scenario, hour)
+    offset = np.arange(n_hours) - np.repeat(block_starts, block_hours)[:n_hours]
+    block_of_hour = np.repeat(np.arange(len(block_starts)), block_hours)[:n_hours]
+    idx = picks[:, block_of_hour] + offset
 
-    grid_search = GridSearchCV(XGBRegressor(), param_grid, cv=3)
-    grid_search.fit(xtrain, ytrain)
+    return point + residual_values[idx]
 
-    return grid_search.best_params_
 
 ### Plotting data
 
@@ -217,13 +400,13 @@ def plotting_forecasted_prices(df2, no_of_training_data_points, xgb_predictions,
     fig = go.Figure()
 
     fig.add_trace(go.Scatter(
-        x=pd.to_datetime(df2.index[no_of_training_data_points:]),
+        x=df2.index[no_of_training_data_points:],
         y=y_test,
         name='actual prices'
     ))
 
     fig.add_trace(go.Scatter(
-        x=pd.to_datetime(df2.index[no_of_training_data_points:]),
+        x=df2.index[no_of_training_data_points:],
         y=xgb_predictions,
         name='predicted prices'
     ))
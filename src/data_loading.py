@@ -2,22 +2,62 @@ from .utils import *
 from .data_cleaning import *
 import pandas as pd
 import glob
+import json
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+
+### Raw ENTSO-E file families and their cleaning functions ###
+
+RAW_FILE_FAMILIES = {
+    "load": ("GUI_TOTAL_LOAD_DAYAHEAD_20*", transform_load_data),
+    "generation": ("AGGREGATED_GENERATION_PER_TYPE_GENERATION_20*", transform_renewables_load_data),
+    "price": ("GUI_ENERGY_PRICES_20*", transform_price_data),
+}
+
+
+# All files of all three families are cleaned concurrently in one process
+# pool and each family is concatenated once. Call from under
+# `if __name__ == "__main__":` in scripts, the process pool re-imports the
+# main module on Windows. n_workers=1 parses in-process.
+#
+# With use_cache=True every cleaned file is kept as parquet in RAW_CACHE_DIR,
+# and only new or changed raw files are parsed again (see load_cached_frames).
+#
+# production_types overrides the ENTSO-E production types kept from the
+# generation files (default: DEFAULT_PRODUCTION_TYPES), e.g.
+# load_raw_data(production_types=[*DEFAULT_PRODUCTION_TYPES, 'Biomass', 'Nuclear']).
+def load_raw_data(n_workers=None, use_cache=True, production_types=None):
+    transforms = {family: transform for family, (_, transform) in RAW_FILE_FAMILIES.items()}
+    if production_types is not None:
+        transforms["generation"] = partial(transforms["generation"], production_types=tuple(production_types))
+
+    jobs = [
+        (family, transforms[family], f)
+        for family, (pattern, _) in RAW_FILE_FAMILIES.items()
+        for f in glob.glob(f'{RAW_DATA_DIR}/{pattern}')
+    ]
+
+    if use_cache:
+        frames = load_cached_frames(jobs, n_workers)
+    else:
+        frames = transform_files(jobs, n_workers)
+
+    family_frames = {family: [] for family in RAW_FILE_FAMILIES}
+    for (family, _, _), frame in zip(jobs, frames):
+        family_frames[family].append(frame)
 
-def load_raw_data():
     # Loading Actual and Forecasted Energy Demand
 
-    all_load_files = glob.glob(f'{RAW_DATA_DIR}/GUI_TOTAL_LOAD_DAYAHEAD_20*')
-    df_load_data = pd.concat([transform_load_data(f) for f in all_load_files]).sort_index()
+    df_load_data = pd.concat(family_frames["load"]).sort_index()
 
     # Loading Renewable Generation Data
 
-    all_rwe_files = glob.glob(f'{RAW_DATA_DIR}/AGGREGATED_GENERATION_PER_TYPE_GENERATION_20*')
-    df_rwe_generation_data = pd.concat([transform_renewables_load_data(f) for f in all_rwe_files]).sort_index()
+    df_rwe_generation_data = pd.concat(family_frames["generation"]).sort_index()
     
     # Loading Price Data from Multiple CSVs
 
-    all_price_files = glob.glob(f'{RAW_DATA_DIR}/GUI_ENERGY_PRICES_20*')
-    df_price_data = pd.concat([transform_price_data(f) for f in all_price_files]).sort_index()
+    df_price_data = pd.concat(family_frames["price"]).sort_index()
     
 
     df_load_data = df_load_data.loc[df_price_data.index.min():df_price_data.index.max()].sort_index()
@@ -30,4 +70,93 @@ def load_raw_data():
     return df_final_data
 
 
+def transform_files(jobs, n_workers=None):
+    n_workers = min(n_workers or os.cpu_count(), max(len(jobs), 1))
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            return list(pool.map(_transform_file, jobs))
+
+    return [_transform_file(job) for job in jobs]
+
+
+def _transform_file(job):
+    _, transform, name_of_file = job
+    return transform(name_of_file)
+
+
+### Incremental raw data cache ###
+# manifest.json in RAW_CACHE_DIR records a fingerprint per raw file: size,
+# mtime and SHA-1 of the content, plus the cache version. A file whose size and
+# mtime are unchanged is a hit; if only its mtime changed (touched, fresh
+# checkout) the hash decides. Misses are parsed in the process pool and
+# written back. Bump RAW_CACHE_VERSION when a transform_* function changes.
+# Keyword options bound to a transform (production_types) are part of the
+# fingerprint, so changing them re-parses the affected family.
+
+RAW_CACHE_VERSION = 3
+
+
+def load_cached_frames(jobs, n_workers=None):
+    manifest_path = RAW_CACHE_DIR/'manifest.json'
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+
+    frames = [None]*len(jobs)
+    fingerprints = {}
+    misses = []
+
+    for i, (family, transform, name_of_file) in enumerate(jobs):
+        key = Path(name_of_file).name
+        stat = os.stat(name_of_file)
+        fp = {
+            "family": family, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+            "version": RAW_CACHE_VERSION, "options": transform_options(transform),
+        }
+
+        entry = manifest.get(key)
+        cache_file = RAW_CACHE_DIR/f'{Path(name_of_file).stem}.parquet'
+        fresh = (
+            entry is not None
+            and cache_file.exists()
+            and all(entry.get(k) == fp[k] for k in ("family", "size", "version", "options"))
+        )
+        if fresh and entry["mtime_ns"] != fp["mtime_ns"]:
+            fp["sha1"] = file_sha1(name_of_file)
+            fresh = entry["sha1"] == fp["sha1"]
+
+        if fresh:
+            frames[i] = pd.read_parquet(cache_file)
+            fingerprints[key] = {**entry, "mtime_ns": fp["mtime_ns"]}
+        else:
+            fingerprints[key] = fp
+            misses.append(i)
+
+    if misses:
+        print(f'Parsing {len(misses)} new or changed raw files, {len(jobs) - len(misses)} from cache \n')
+
+        RAW_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        parsed = transform_files([jobs[i] for i in misses], n_workers)
+
+        for i, frame in zip(misses, parsed):
+            name_of_file = jobs[i][2]
+            key = Path(name_of_file).name
+            frame.to_parquet(RAW_CACHE_DIR/f'{Path(name_of_file).stem}.parquet', compression="zstd")
+            fingerprints[key].setdefault("sha1", file_sha1(name_of_file))
+            frames[i] = frame
+
+    # raw files that disappeared drop out of the manifest
+    for key in set(manifest) - set(fingerprints):
+        (RAW_CACHE_DIR/f'{Path(key).stem}.parquet').unlink(missing_ok=True)
+
+    if fingerprints != manifest:
+        RAW_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = manifest_path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(fingerprints, indent=1))
+        os.replace(tmp_path, manifest_path)
+
+    return frames
+
 
+# JSON-safe view of the keyword arguments bound with functools.partial
+def transform_options(transform):
+    return {k: list(v) if isinstance(v, tuple) else v for k, v in getattr(transform, "keywords", {}).items()}
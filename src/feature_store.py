@@ -0,0 +1,260 @@
+from .utils import *
+import hashlib
+import json
+
+
+### Forecast features ###
+# day_ahead=True (default) builds a true day-ahead feature set: every hour of
+# delivery day D only sees information available at the day-ahead gate
+# closure (D-1 12:00). That is the prices up to the end of D-1, which were
+# cleared the day before. So the price lags reach at least back to the last
+# hour of D-1, and the rolling statistics are those of the previous day/week
+# as of the end of D-1. A multi-day test block is then a sequence of day-ahead
+# forecasts, each made at its own gate closure. The model is direct: one
+# predict call covers all hours, with no recursion.
+#
+# Actual load and generation are measured after delivery. The day-ahead set
+# leaves them out of the model inputs and uses their D-1 values from before
+# the gate closure instead (day_ahead_fundamental_features).
+#
+# day_ahead=False keeps the original hour-ahead features (lag_1h, short
+# rolling means). These use prices from inside the forecast day.
+#
+# Every feature function takes the data frame and returns only its feature
+# columns, the input frame is never modified.
+
+GATE_CLOSURE_HOUR = 12
+
+
+def calendar_features(df):
+    dates = df.index.to_series()
+
+    return pd.DataFrame({
+        'date': dates,
+        'hour': dates.dt.hour,
+        'dayofweek': dates.dt.dayofweek,
+        'dayofmonth': dates.dt.day,
+        'dayofyear': dates.dt.dayofyear,
+    }, index=df.index)
+
+
+def hour_ahead_price_features(df):
+    price = df['DA_Price']
+
+    return pd.DataFrame({
+        # adding lags
+        'lag_1h': price.shift(1),
+        'lag_24h': price.shift(24),
+        'lag_168h': price.shift(168),
+        # adding rolling mean
+        'rolling_mean_2h': price.rolling(window=2).mean(),
+        'rolling_mean_3h': price.rolling(window=3).mean(),
+        'rolling_mean_6h': price.rolling(window=6).mean(),
+    }, index=df.index)
+
+
+def day_ahead_price_features(df):
+    price = df['DA_Price'].to_numpy(dtype=float)
+    n_rows = len(price)
+    day_codes, day_start, day_end, hour_of_day = delivery_days(df.index)
+
+    features = pd.DataFrame(index=df.index)
+
+    # lags, never closer than the last hour of the previous day
+    for lag in (24, 48, 168):
+        features[f'lag_{lag}h'] = gate_closure_lag(price, lag, hour_of_day)
+
+    # previous day / previous week statistics as of the end of D-1
+    daily = np.column_stack([
+        np.add.reduceat(price, day_start) / np.diff(np.r_[day_start, n_rows]),
+        np.minimum.reduceat(price, day_start),
+        np.maximum.reduceat(price, day_start),
+        price[day_end],
+        df['DA_Price'].rolling(window=168).mean().to_numpy()[day_end],
+    ])
+    prev_daily = np.vstack([np.full((1, daily.shape[1]), np.nan), daily[:-1]])[day_codes]
+
+    for i, col in enumerate(['prev_day_mean', 'prev_day_min', 'prev_day_max', 'prev_day_last', 'prev_week_mean']):
+        features[col] = prev_daily[:, i]
+
+    return features
+
+
+# actual load and generation are measured after delivery, so hour h of day D
+# only sees the previous day's value at hour min(h, 11), the last hour before
+# the D-1 12:00 gate closure (see ex_post_columns)
+def day_ahead_fundamental_features(df):
+    src = before_gate_closure(df.index)
+
+    features = {}
+    for col in ex_post_columns(df):
+        values = df[col].to_numpy(dtype=float)
+        features[f'{col}_prev_day'] = np.where(src >= 0, values[np.maximum(src, 0)], np.nan)
+
+    return pd.DataFrame(features, index=df.index)
+
+
+# columns only known after delivery: actual load and every generation column
+# (any configured production type, see data_cleaning.GENERATION_COLUMNS)
+def ex_post_columns(df):
+    return [col for col in df.columns if col == 'actual_load' or col.endswith('_generation')]
+
+
+# delivery day of every row, in row positions (23/24/25 rows per day)
+def delivery_days(index):
+    day_codes, _ = pd.factorize(index.normalize())
+    day_start = np.flatnonzero(np.r_[True, day_codes[1:] != day_codes[:-1]])
+    day_end = np.r_[day_start[1:], len(index)] - 1
+    hour_of_day = np.arange(len(index)) - day_start[day_codes]
+
+    return day_codes, day_start, day_end, hour_of_day
+
+
+# row of the previous day at clock hour min(h, GATE_CLOSURE_HOUR - 1), by local
+# time so 23/25 hour days cannot shift it past the gate closure (-1: no such row)
+def before_gate_closure(index):
+    day_codes, _ = pd.factorize(index.normalize())
+    keys = day_codes*24 + np.asarray(index.hour)
+    targets = (day_codes - 1)*24 + np.minimum(np.asarray(index.hour), GATE_CLOSURE_HOUR - 1)
+
+    return np.searchsorted(keys, targets, side='right') - 1
+
+
+# value lag hours back, but never closer than the last hour of the previous day
+def gate_closure_lag(values, lag, hour_of_day):
+    src = np.arange(len(values)) - np.maximum(lag, hour_of_day + 1)
+    return np.where(src >= 0, values[np.maximum(src, 0)], np.nan)
+
+
+### Feature registry ###
+# name -> (function, lookback_hours, version)
+# lookback_hours is the history a feature needs before an hour to compute it
+# (the day-ahead prices reach 168h back from the end of the previous day).
+# Bump the version when a feature function changes, the feature store then
+# recomputes that feature (and only that one) over the full history.
+#
+# A new feature (load ratio, renewable share, holidays, ...) is a function in
+# the style above plus a registry entry, added to the feature sets that use it.
+
+FEATURE_REGISTRY = {
+    'calendar': (calendar_features, 0, 1),
+    'hour_ahead_prices': (hour_ahead_price_features, 168, 1),
+    'day_ahead_prices': (day_ahead_price_features, 168 + 24, 1),
+    'day_ahead_fundamentals': (day_ahead_fundamental_features, 24, 2),
+}
+
+FEATURE_SETS = {
+    'day_ahead': ['calendar', 'day_ahead_prices', 'day_ahead_fundamentals'],
+    'hour_ahead': ['calendar', 'hour_ahead_prices'],
+}
+
+
+def create_features(df, day_ahead=True):
+    return pd.concat([df, compute_features(df, feature_set_groups(day_ahead))], axis=1)
+
+
+def compute_features(df, groups):
+    return pd.concat([FEATURE_REGISTRY[group][0](df) for group in groups], axis=1)
+
+
+def feature_set_groups(day_ahead):
+    return FEATURE_SETS['day_ahead' if day_ahead else 'hour_ahead']
+
+
+# names of the columns every registered feature group adds to df (computed on
+# its first day, the generation features depend on the production types)
+def feature_columns(df):
+    return [col for function, _, _ in FEATURE_REGISTRY.values() for col in function(df.iloc[:24]).columns]
+
+
+### Incremental feature store ###
+# The features of a feature set are kept as parquet in FEATURE_STORE_DIR, next
+# to a manifest with the number of rows, a hash of the input frame they were
+# computed from and the version and columns of every feature.
+#
+# load_features returns the same frame as create_features. If the stored rows
+# are a prefix of the new data (hours were only appended), each feature is
+# computed on the new hours plus its lookback, extended back to the start of
+# that day, and appended. New or changed features are recomputed over the full
+# history, the others are kept. Any other change to the input data rebuilds
+# the store. Stored rows are never rewritten on append, so the model registry
+# still recognises the training frame as a prefix.
+
+def load_features(data, day_ahead=True, use_store=True):
+    if not use_store:
+        return create_features(data, day_ahead)
+
+    name = 'day_ahead' if day_ahead else 'hour_ahead'
+    groups = feature_set_groups(day_ahead)
+
+    store_file = FEATURE_STORE_DIR/f'{name}.parquet'
+    manifest_path = FEATURE_STORE_DIR/f'{name}.json'
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else None
+
+    n = manifest["n_rows"] if manifest is not None else 0
+    valid = (
+        manifest is not None
+        and store_file.exists()
+        and n <= len(data)
+        and data_hash(data.iloc[:n]) == manifest["data_hash"]
+    )
+
+    if not valid:
+        print(f'Computing {name} features for {len(data)} hours \n')
+        parts = [FEATURE_REGISTRY[group][0](data) for group in groups]
+        if manifest is not None and n > len(data):
+            # shorter history than the store holds, keep the store as is
+            return pd.concat([data, *parts], axis=1)
+    else:
+        stored = pd.read_parquet(store_file)
+        parts = []
+
+        for group in groups:
+            function, lookback_hours, version = FEATURE_REGISTRY[group]
+            entry = manifest["features"].get(group)
+
+            if entry is None or entry["version"] != version:
+                print(f'Computing feature "{group}" over the full history \n')
+                parts.append(function(data))
+            elif n == len(data):
+                parts.append(stored[entry["columns"]])
+            else:
+                start = overlap_start(data.index, n, lookback_hours)
+                new = function(data.iloc[start:]).iloc[n - start:]
+                parts.append(pd.concat([stored[entry["columns"]], new]))
+
+        if n < len(data):
+            print(f'Computing {name} features for {len(data) - n} new hours, {n} from store \n')
+
+    features = pd.concat(parts, axis=1)
+
+    new_manifest = {
+        "n_rows": len(data),
+        "data_hash": data_hash(data),
+        "features": {
+            group: {"version": FEATURE_REGISTRY[group][2], "columns": list(part.columns)}
+            for group, part in zip(groups, parts)
+        },
+    }
+
+    if new_manifest != manifest:
+        FEATURE_STORE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_file = store_file.with_suffix('.tmp')
+        features.to_parquet(tmp_file, compression="zstd")
+        os.replace(tmp_file, store_file)
+
+        tmp_path = manifest_path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(new_manifest, indent=1))
+        os.replace(tmp_path, manifest_path)
+
+    return pd.concat([data, features], axis=1)
+
+
+# first row needed to compute rows n.. : lookback_hours back, then to the start of that day
+def overlap_start(index, n, lookback_hours):
+    first = max(n - lookback_hours, 0)
+    return int(index.searchsorted(index[first].normalize()))
+
+
+def data_hash(df):
+    return hashlib.sha1(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes()).hexdigest()
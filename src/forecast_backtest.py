@@ -0,0 +1,123 @@
+from .utils import *
+from .data_forecasting import create_features, model_inputs, error_metrics, XGB_PARAMS
+from .model_registry import train_forecast_model, update_forecast_model
+import pandas as pd
+import numpy as np
+import os
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+
+
+### Rolling-origin backtest of the day-ahead price forecaster ###
+# The forecast origin walks day by day (local midnight) from start_date to
+# end_date. At every origin the model only sees hours before the origin and
+# forecasts the following delivery day (23/24/25 hours).
+#
+# The origins are cut into blocks of retrain_every_days. The first origin of
+# each block trains from scratch on the history before it (the last
+# train_window_days only, if given). The block's following origins update
+# that model by continued boosting on the newly appended day, the same way
+# the model registry updates the production model. Blocks are independent,
+# so they run in parallel, and the cores are split between pool workers and
+# XGBoost threads.
+#
+# Returns per-origin metrics (MAE, RMSE, sMAPE) and the hourly forecasts.
+# Call from under `if __name__ == "__main__":` in scripts, the process pool
+# re-imports the main module on Windows.
+
+_backtest_data = None
+
+
+def run_forecast_backtest(data, start_date, end_date, params=None, retrain_every_days=7, train_window_days=None,
+                          incremental_rounds=20, incremental_window_hours=28*24, n_workers=None, day_ahead=True):
+
+    data_df = create_features(data, day_ahead)
+
+    X, y = model_inputs(data_df, day_ahead)
+
+    tz = data_df.index.tz
+    start = as_timeline_time(start_date, tz)
+    end = as_timeline_time(end_date, tz)
+
+    # delivery days: [origin, next origin) in row positions
+    day_starts = np.flatnonzero(data_df.index.hour == 0)
+    day_ends = np.append(day_starts[1:], len(data_df))
+    in_range = (data_df.index[day_starts] >= start) & (data_df.index[day_starts] <= end)
+    origins = list(zip(day_starts[in_range], day_ends[in_range]))
+
+    if not origins:
+        raise ValueError("No forecast origins between start_date and end_date.")
+    if origins[0][0] < 7*24:
+        raise ValueError("The first forecast origin needs at least a week of history before it.")
+
+    blocks = [origins[i:i + retrain_every_days] for i in range(0, len(origins), retrain_every_days)]
+
+    n_cpu = os.cpu_count()
+    n_workers = min(n_workers or n_cpu, len(blocks))
+    threads = max(n_cpu // n_workers, 1)
+
+    fit_params = {**(params or XGB_PARAMS), 'n_jobs': threads}
+    train_window = train_window_days*24 if train_window_days else None
+    shared = (
+        X.to_numpy(dtype=np.float32), y.to_numpy(dtype=np.float64),
+        fit_params, train_window, incremental_rounds, incremental_window_hours,
+    )
+
+    print(f'Backtesting {len(origins)} forecast origins in {len(blocks)} blocks on {n_workers} worker processes \n')
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_backtest_worker, initargs=(shared,)) as pool:
+            results = list(pool.map(_backtest_block, blocks))
+    else:
+        _init_backtest_worker(shared)
+        results = [_backtest_block(block) for block in blocks]
+
+    rows = []
+    forecasts = []
+    for block, block_results in zip(blocks, results):
+        for (origin, next_origin), (predictions, fit, fit_time) in zip(block, block_results):
+            actual = y.iloc[origin:next_origin]
+            rows.append({
+                'origin': data_df.index[origin],
+                **error_metrics(predictions, actual),
+                'n_hours': next_origin - origin,
+                'fit': fit,
+                'fit_time_s': fit_time,
+            })
+            forecasts.append(pd.DataFrame({'DA_Price': actual, 'forecasted_prices': predictions, 'origin': data_df.index[origin]}))
+
+    df_metrics = pd.DataFrame(rows).set_index('origin')
+    df_forecasts = pd.concat(forecasts)
+
+    return df_metrics, df_forecasts
+
+
+def _init_backtest_worker(shared):
+    global _backtest_data
+    _backtest_data = shared
+
+
+def _backtest_block(block):
+    X, y, params, train_window, incremental_rounds, incremental_window_hours = _backtest_data
+
+    results = []
+    model = None
+    prev_origin = None
+
+    for origin, next_origin in block:
+        t0 = perf_counter()
+
+        if model is None:
+            lo = max(origin - train_window, 0) if train_window else 0
+            model = train_forecast_model(X[lo:origin], y[lo:origin], params)
+            fit = 'full'
+        else:
+            lo = max(prev_origin - incremental_window_hours, 0)
+            model = update_forecast_model(model, X[lo:origin], y[lo:origin], params, incremental_rounds)
+            fit = 'update'
+
+        fit_time = perf_counter() - t0
+        results.append((model.predict(X[origin:next_origin]), fit, fit_time))
+        prev_origin = origin
+
+    return results
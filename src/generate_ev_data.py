@@ -1,29 +1,29 @@
 from .utils import *
 import pandas as pd
 import numpy as np
+from functools import lru_cache
+from .feature_store import feature_columns
+
+
+# calendar columns kept in the exported forecast, every other feature column
+# of the feature registry is dropped (see feature_store.feature_columns)
+EXPORTED_FEATURE_COLUMNS = ['date', 'dayofweek']
 
 
 def modify_ev_data(forecasted_prices):
-    df_forecasted = forecasted_prices.drop(columns=['hour', 'dayofmonth', 'dayofyear', 'lag_1h', 'lag_24h', 'lag_168h', 'rolling_mean_2h', 'rolling_mean_3h', 'rolling_mean_6h']).copy()
+    drop = [col for col in feature_columns(forecasted_prices) if col not in EXPORTED_FEATURE_COLUMNS]
+    df_forecasted = forecasted_prices.drop(columns=drop, errors='ignore').copy()
 
     #sim_start = df_forecasted["timestamp"].min()
     sim_start = df_forecasted.index.min()
     sim_end   = df_forecasted.index.max()
     #sim_end   = df_forecasted["timestamp"].max()
 
-    price_temp = df_forecasted.copy()
-    price_temp['date'] = pd.to_datetime(price_temp['date']).dt.strftime('%Y-%m-%d')
-    uniq_dates = price_temp['date'].unique()
-    days_df = price_temp.loc[price_temp['date'].isin(uniq_dates)]
-    days_df = days_df[['date','dayofweek']].drop_duplicates()
-
-    df_ev_data = pd.DataFrame()
+    # calendar dates of the forecast horizon (local midnights)
+    days_df = pd.DataFrame({'date': df_forecasted.index.normalize().unique()})
+    days_df['dayofweek'] = days_df['date'].dt.dayofweek
 
-    for date in days_df["date"]:
-        df_ev_data = pd.concat([
-            df_ev_data,
-            extract_ev_data(date, days_df, sim_start, sim_end, max_stay_days=2)
-        ])
+    df_ev_data = build_ev_sessions(days_df, sim_start, sim_end, max_stay_days=2)
 
     summarize_ev_data(df_ev_data)
 
@@ -36,70 +36,278 @@ def modify_ev_data(forecasted_prices):
 
 
 def extract_ev_data(date_val, days_df, sim_start, sim_end, max_stay_days=2):
-
-    # Identify weekday from master calendar
-    day = days_df.loc[days_df["date"] == date_val, "dayofweek"].values[0]
-
-    # Load EV CSV for that weekday
-    temp_df = pd.read_csv(f"{EV_DATA_DIR}/EVData_day{day}.csv")
-    temp_df["day"] = day
-    temp_df["date"] = pd.to_datetime(date_val)
-
-    # Rename columns
-    temp_df = temp_df.rename(columns={
-        "EV ID": "ev_id",
-        "Time of Arrival": "toa",
-        "Time of Departure": "tod",
-        "Initial SOC": "i_soc",
-        "Desired SOC": "d_soc",
-        "Maximum Battery Capacity": "max_battery_capacity",
-        "Duration of Stay": "dos",
-    })
+    return build_ev_sessions(days_df.loc[days_df["date"] == date_val], sim_start, sim_end, max_stay_days)
+
+
+# All sessions of all calendar dates in one pass: every date is crossed with
+# its weekday template, and arrival/departure are computed as int64
+# nanoseconds. Rows are ordered by date, then template row; the index
+# restarts at 0 for every date. Times are in the time zone of sim_start.
+def build_ev_sessions(days_df, sim_start, sim_end, max_stay_days=2):
+    dates = pd.DatetimeIndex(pd.to_datetime(days_df["date"]))
+    weekdays = days_df["dayofweek"].to_numpy()
+
+    # stack the templates of the weekdays in use, remembering where each starts
+    templates = [load_weekday_template(int(day)) for day in np.unique(weekdays)]
+    sizes = np.zeros(7, dtype=np.int64)
+    sizes[np.unique(weekdays)] = [len(t["ev_id"]) for t in templates]
+    starts = np.cumsum(sizes) - sizes
+    stacked = {key: np.concatenate([t[key] for t in templates]) for key in ("ev_id", "toa_min", "dos_min", "i_soc", "d_soc", "max_battery_capacity")}
+
+    # calendar x template rows
+    counts = sizes[weekdays]
+    date_of_row = np.repeat(np.arange(len(dates)), counts)
+    row_in_date = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    rows = starts[weekdays][date_of_row] + row_in_date
 
     # ---------------------------------------------------
-    # 1. Convert ToA, ToD, DoS
+    # 1. ToA, ToD from minute offsets, max stay rule (48 hours max)
+    # 2. Clamp toa/tod to simulation window
     # ---------------------------------------------------
-    base_date = pd.to_datetime(date_val)
+    stay_min = np.minimum(stacked["dos_min"][rows], max_stay_days*24*60)
+    toa, tod, date = session_times(dates, date_of_row, stacked["toa_min"][rows], stay_min, sim_start, sim_end)
 
-    temp_df["toa"] = base_date + pd.to_timedelta(temp_df["toa"] + ":00")
-    temp_df["dos"] = pd.to_timedelta(temp_df["dos"] + ":00")
-    temp_df["tod"] = temp_df["toa"] + temp_df["dos"]
+    return pd.DataFrame({
+        "ev_id": stacked["ev_id"][rows].astype(object),
+        "toa": toa,
+        "tod": tod,
+        "i_soc": stacked["i_soc"][rows],
+        "d_soc": stacked["d_soc"][rows],
+        "max_battery_capacity": stacked["max_battery_capacity"][rows],
+        "dos": (stacked["dos_min"][rows].astype(np.int64)*MINUTE_NS).view("timedelta64[ns]"),
+        "day": weekdays[date_of_row],
+        "date": date,
+    }, index=row_in_date)
 
-    # ---------------------------------------------------
-    # 2. Clamp ToD to max_stay_days && simulation horizon
-    # ---------------------------------------------------
-    max_stay = pd.Timedelta(days=max_stay_days)
 
-    # Enforce max stay rule (48 hours max)
-    temp_df["tod"] = temp_df.apply(
-        lambda row: min(row["tod"], row["toa"] + max_stay),
-        axis=1
-    )
+MINUTE_NS = np.int64(60*10**9)
 
-    # Clamp toa/tod to simulation window
-    temp_df["toa"] = temp_df["toa"].clip(lower=sim_start, upper=sim_end)
-    temp_df["tod"] = temp_df["tod"].clip(lower=sim_start, upper=sim_end)
 
-    # ---------------------------------------------------
-    # 3. Hour-floor versions (for time_to_idx)
-    # ---------------------------------------------------
-    #temp_df["toa"] = temp_df["toa"].dt.floor("h")
-    #temp_df["tod"] = temp_df["tod"].dt.floor("h")
+# Arrival = local calendar date + arrival minutes on the wall clock, departure =
+# arrival + stay minutes of elapsed time, both clipped to [sim_start, sim_end].
+# Results are in the time zone of sim_start (naive if sim_start is naive). An
+# arrival in the skipped spring hour moves forward, one in the repeated autumn
+# hour is read as winter time.
+def session_times(dates, date_of_row, toa_min, stay_min, sim_start, sim_end):
+    tz = pd.Timestamp(sim_start).tz
+    local_dates = (dates.tz_localize(None) if dates.tz is not None else dates).as_unit('ns')
+
+    wall_toa = local_dates.asi8[date_of_row] + toa_min.astype(np.int64)*MINUTE_NS
+    if tz is None:
+        toa_ns = wall_toa
+        date_ns = local_dates.asi8[date_of_row]
+    else:
+        toa_ns = pd.DatetimeIndex(wall_toa.view("datetime64[ns]")).tz_localize(tz, ambiguous=False, nonexistent="shift_forward").asi8
+        date_ns = local_dates.tz_localize(tz).asi8[date_of_row]
+    tod_ns = toa_ns + stay_min.astype(np.int64)*MINUTE_NS
+
+    lower = as_timeline_time(sim_start, tz).value
+    upper = as_timeline_time(sim_end, tz).value
+
+    def as_times(ns):
+        if tz is None:
+            return ns.view("datetime64[ns]")
+        return pd.DatetimeIndex(ns, tz="UTC").tz_convert(tz)
+
+    return as_times(np.clip(toa_ns, lower, upper)), as_times(np.clip(tod_ns, lower, upper)), as_times(date_ns)
+
+
+### Weekday EV templates ###
+# EVData_day{0..6}.csv parsed into arrays, arrival and stay as integer minutes.
+# Each file is parsed once per process (lru_cache) and persisted as .npz in
+# EV_CACHE_DIR. The binary cache is reused while the CSV's mtime is unchanged,
+# or its content hash still matches (e.g. after a fresh checkout).
+
+TEMPLATE_COLUMNS = {
+    "EV ID": "ev_id",
+    "Time of Arrival": "toa",
+    "Initial SOC": "i_soc",
+    "Desired SOC": "d_soc",
+    "Maximum Battery Capacity": "max_battery_capacity",
+    "Duration of Stay": "dos",
+}
+
+
+@lru_cache(maxsize=None)
+def load_weekday_template(day):
+    csv_path = EV_DATA_DIR/f"EVData_day{day}.csv"
+    cache_path = EV_CACHE_DIR/f"EVData_day{day}.npz"
+
+    mtime_ns = os.stat(csv_path).st_mtime_ns
+
+    template = None
+    if cache_path.exists():
+        with np.load(cache_path, allow_pickle=False) as cached:
+            cached = dict(cached)
+
+        if int(cached["mtime_ns"]) == mtime_ns:
+            return cached
+
+        # touched but unchanged, only the stored mtime needs refreshing
+        if str(cached["sha1"]) == file_sha1(csv_path):
+            template = cached
+
+    if template is None:
+        template = parse_weekday_template(csv_path)
+        template["sha1"] = np.str_(file_sha1(csv_path))
+
+    template["mtime_ns"] = np.int64(mtime_ns)
+
+    EV_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    np.savez(cache_path, **template)
+
+    return template
+
+
+def parse_weekday_template(csv_path):
+    temp_df = pd.read_csv(csv_path, usecols=list(TEMPLATE_COLUMNS), dtype={"Time of Arrival": str, "Duration of Stay": str})
+    temp_df = temp_df.rename(columns=TEMPLATE_COLUMNS)
+
+    return {
+        "ev_id": temp_df["ev_id"].to_numpy(dtype=str),
+        "toa_min": hhmm_to_minutes(temp_df["toa"]),
+        "dos_min": hhmm_to_minutes(temp_df["dos"]),
+        "i_soc": temp_df["i_soc"].to_numpy(),
+        "d_soc": temp_df["d_soc"].to_numpy(),
+        "max_battery_capacity": temp_df["max_battery_capacity"].to_numpy(),
+    }
+
+
+# "HH:MM" strings -> int32 minutes (hours may exceed 24 for long stays)
+def hhmm_to_minutes(values):
+    parts = values.str.split(":", n=1, expand=True).astype(np.int32)
+    return (parts[0]*60 + parts[1]).to_numpy(dtype=np.int32)
+
+
+### Synthetic EV fleet ###
+# Samples arbitrarily large fleets from distributions fitted to the weekday
+# templates (kernel density style: a template session is drawn and jittered).
+#   arrival      template arrival + normal noise, wrapped around midnight
+#   stay         template stay with log-normal noise (stays positive)
+#   SOC          template initial/desired SOC + normal noise, 0-100 %,
+#                desired never below initial
+#   capacity     capacity of the drawn template session (kept discrete)
+# Drawing whole template sessions keeps the arrival/stay/SOC correlations.
+# Noise scales follow Silverman's rule per weekday.
+#
+# Every simulated date has its own seed derived from (seed, date number), so a
+# fleet is reproducible independently of the chunk size. Chunks of chunk_days
+# dates are generated one at a time, memory is bounded by a single chunk.
+
+FLEET_COLUMNS = ("toa_min", "dos_min", "i_soc", "d_soc", "max_battery_capacity")
+
+
+def fit_fleet_model():
+    model = {}
+    for day in range(7):
+        template = load_weekday_template(day)
+        n = len(template["ev_id"])
+
+        def bandwidth(values):
+            return 1.06 * np.std(values) * n**(-1/5)
+
+        log_stay = np.log(np.maximum(template["dos_min"], 1))
 
-    return temp_df
+        model[day] = {
+            **{key: template[key] for key in FLEET_COLUMNS},
+            "log_dos": log_stay,
+            "bw_toa": bandwidth(template["toa_min"]),
+            "bw_log_dos": bandwidth(log_stay),
+            "bw_soc": bandwidth(np.concatenate([template["i_soc"], template["d_soc"]])),
+        }
+
+    return model
+
+
+def iter_synthetic_fleet(start_date, n_days, n_ev_per_day, seed=0, chunk_days=30, max_stay_days=2, fleet_model=None, tz=MARKET_TZ):
+    fleet_model = fleet_model or fit_fleet_model()
+
+    # local calendar date of the first day
+    start = pd.Timestamp(start_date).normalize()
+    if start.tzinfo is not None:
+        start = start.tz_localize(None)
+    sim_start = as_timeline_time(start, tz)
+    sim_end = as_timeline_time(start + pd.Timedelta(days=n_days), tz) - pd.Timedelta(hours=1)
+    seed_seq = np.random.SeedSequence(seed)
+    ev_ids = np.array([f"V{i+1}" for i in range(n_ev_per_day)], dtype=object)
+
+    for first_day in range(0, n_days, chunk_days):
+        days_in_chunk = range(first_day, min(first_day + chunk_days, n_days))
+        dates = pd.DatetimeIndex([start + pd.Timedelta(days=d) for d in days_in_chunk])
+
+        sampled = [
+            sample_fleet_day(fleet_model[date.dayofweek], n_ev_per_day,
+                             np.random.default_rng(np.random.SeedSequence(seed_seq.entropy, spawn_key=(d,))))
+            for d, date in zip(days_in_chunk, dates)
+        ]
+        sampled = {key: np.concatenate([day[key] for day in sampled]) for key in FLEET_COLUMNS}
+
+        date_of_row = np.repeat(np.arange(len(dates)), n_ev_per_day)
+        stay_min = np.minimum(sampled["dos_min"], max_stay_days*24*60)
+        toa, tod, date = session_times(dates, date_of_row, sampled["toa_min"], stay_min, sim_start, sim_end)
+
+        yield pd.DataFrame({
+            "ev_id": np.tile(ev_ids, len(dates)),
+            "toa": toa,
+            "tod": tod,
+            "i_soc": sampled["i_soc"],
+            "d_soc": sampled["d_soc"],
+            "max_battery_capacity": sampled["max_battery_capacity"],
+            "dos": (sampled["dos_min"].astype(np.int64)*MINUTE_NS).view("timedelta64[ns]"),
+            "day": dates.dayofweek.to_numpy()[date_of_row],
+            "date": date,
+        })
+
+
+def sample_fleet_day(day_model, n_ev, rng):
+    pick = rng.integers(0, len(day_model["toa_min"]), n_ev)
+
+    toa = day_model["toa_min"][pick] + rng.normal(0, day_model["bw_toa"], n_ev)
+    toa = np.mod(np.rint(toa), 24*60).astype(np.int32)
+
+    log_dos = day_model["log_dos"][pick] + rng.normal(0, day_model["bw_log_dos"], n_ev)
+    dos = np.maximum(np.rint(np.exp(log_dos)), 1).astype(np.int32)
+
+    soc_noise = rng.normal(0, day_model["bw_soc"], (2, n_ev))
+    i_soc = np.clip(np.rint(day_model["i_soc"][pick] + soc_noise[0]), 0, 100).astype(np.int64)
+    d_soc = np.clip(np.rint(day_model["d_soc"][pick] + soc_noise[1]), 0, 100).astype(np.int64)
+    d_soc = np.maximum(d_soc, i_soc)
+
+    return {
+        "toa_min": toa,
+        "dos_min": dos,
+        "i_soc": i_soc,
+        "d_soc": d_soc,
+        "max_battery_capacity": day_model["max_battery_capacity"][pick],
+    }
+
+
+# Writes the fleet as one parquet file per chunk, returns the file paths.
+# Read back with pd.read_parquet(out_dir) or chunk by chunk.
+def write_synthetic_fleet(start_date, n_days, n_ev_per_day, seed=0, chunk_days=30, out_dir=None):
+    out_dir = Path(out_dir or EV_DATA_DIR/"synthetic")
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    paths = []
+    chunks = iter_synthetic_fleet(start_date, n_days, n_ev_per_day, seed, chunk_days)
+    for i, chunk in enumerate(chunks):
+        path = out_dir/f"fleet_{i:04d}.parquet"
+        chunk.to_parquet(path, index=False, compression="zstd")
+        paths.append(path)
+
+    return paths
 
 
 def plot_EV_data(df_ev, df_fc):
     df_ev_all = df_ev.copy()
-    df_ev_all["arrival_hour"] = df_ev_all["toa"].dt.floor("h")
-    df_ev_all["departure_hour"] = df_ev_all["tod"].dt.floor("h")
+    df_ev_all["arrival_hour"] = floor_to_hour(df_ev_all["toa"])
+    df_ev_all["departure_hour"] = floor_to_hour(df_ev_all["tod"])
 
     arrivals = df_ev_all.groupby("arrival_hour").size().rename("arrivals")
     departures = df_ev_all.groupby("departure_hour").size().rename("departures")
 
     df_fc = df_fc.reset_index(drop=False)
     df_full = df_fc[["timestamp"]].copy()
-    df_full["timestamp"] = pd.to_datetime(df_full["timestamp"])
 
 
     df_full = df_full.merge(arrivals.rename("arrivals"), left_on="timestamp", right_index=True, how="left")
@@ -128,10 +336,7 @@ def summarize_ev_data(df_ev):
 
     df_tmp = df_ev.copy()
 
-    # Ensure timestamps are parsed correctly
-    df_tmp["toa"] = pd.to_datetime(df_tmp["toa"])
-    df_tmp["tod"] = pd.to_datetime(df_tmp["tod"])
-    df_tmp["date"] = pd.to_datetime(df_tmp["date"]).dt.date
+    df_tmp["date"] = df_tmp["date"].dt.date
 
     # Duration in hours
     df_tmp["duration_hours"] = (df_tmp["tod"] - df_tmp["toa"]).dt.total_seconds() / 3600
@@ -0,0 +1,257 @@
+from .utils import *
+import numpy as np
+import scipy.sparse as sp
+import highspy
+
+
+### Matrix based LP backend ###
+# Builds the charging LP of optimization_model.build_model directly as sparse
+# arrays and hands it to highspy, skipping Pyomo expression building and the
+# file based solver interface.
+#
+# Column layout:  [ PD (one per EV-hour pair) | SOC (one per pair) | slack (one per EV) ]
+# Row layout:     [ SOC dynamics (one per pair) | departure SOC (one per EV) | SOC floors ]
+# The power limit and battery capacity constraints are plain column bounds.
+#
+# Optional per-pair entries in opt_data override the per-EV limits, used by the
+# aggregated envelope model: "PD_max" (power bound), "SOC_max" (SOC bound) and
+# "SOC_min" (soft SOC floor sharing the EV's departure slack).
+
+
+def build_lp_arrays(opt_data):
+    pair_ev = opt_data["pair_ev"]
+    pair_t = opt_data["pair_t"]
+    avail = opt_data["avail"]
+
+    arrival = opt_data["arrival"]
+    departure = opt_data["departure"]
+    SOC_init = opt_data["SOC_init"]
+    SOC_desired = opt_data["SOC_desired"]
+    MC = opt_data["MC"]
+    MP = opt_data["MP"]
+
+    price = opt_data["price"]
+    R = opt_data["R"]
+
+    n_ev = len(opt_data["EV_list"])
+    n_pairs = len(pair_ev)
+
+    eta = opt_data["eta"]
+
+    pd_col = np.arange(n_pairs)
+    soc_col = n_pairs + pd_col
+    slack_col = 2*n_pairs + np.arange(n_ev)
+    n_col = 2*n_pairs + n_ev
+
+    # objective
+    c = np.zeros(n_col)
+    c[pd_col] = (price[pair_t] + opt_data["lambda_carbon"]*(1 - R[pair_t])) / 1000
+    c[slack_col] = opt_data["SOC_penalty_weight"]
+
+    # bounds: power limit on PD, battery capacity on SOC
+    col_lower = np.zeros(n_col)
+    col_upper = np.full(n_col, np.inf)
+    col_upper[pd_col] = opt_data["PD_max"] if "PD_max" in opt_data else MP[pair_ev] * avail
+    col_upper[soc_col] = opt_data["SOC_max"] if "SOC_max" in opt_data else MC[pair_ev]
+
+    # SOC dynamics: SOC[t] - SOC[t-1] - eta*PD[t] = 0, or = SOC_init at arrival
+    is_first = pair_t == arrival[pair_ev]
+    prev = np.flatnonzero(~is_first)
+
+    dyn_rows = np.concatenate([pd_col, pd_col, prev])
+    dyn_cols = np.concatenate([soc_col, pd_col, soc_col[prev - 1]])
+    dyn_vals = np.concatenate([np.ones(n_pairs), np.full(n_pairs, -eta), -np.ones(len(prev))])
+    dyn_rhs = np.where(is_first, SOC_init[pair_ev], 0.0)
+
+    # departure SOC: SOC[t_d] + slack >= SOC_desired
+    last = np.flatnonzero(pair_t == departure[pair_ev])
+    dep_rows = n_pairs + pair_ev[last]
+    dep_rows = np.concatenate([dep_rows, n_pairs + np.arange(n_ev)])
+    dep_cols = np.concatenate([soc_col[last], slack_col])
+    dep_vals = np.ones(len(dep_cols))
+
+    # soft SOC floors: SOC[t] + slack >= SOC_min[t]
+    floor = np.flatnonzero(opt_data["SOC_min"] > 0) if "SOC_min" in opt_data else np.array([], dtype=np.int64)
+    floor_rows = n_pairs + n_ev + np.repeat(np.arange(len(floor)), 2)
+    floor_cols = np.column_stack([soc_col[floor], slack_col[pair_ev[floor]]]).ravel()
+    floor_vals = np.ones(len(floor_cols))
+
+    n_row = n_pairs + n_ev + len(floor)
+    A = sp.csr_matrix(
+        (
+            np.concatenate([dyn_vals, dep_vals, floor_vals]),
+            (np.concatenate([dyn_rows, dep_rows, floor_rows]), np.concatenate([dyn_cols, dep_cols, floor_cols])),
+        ),
+        shape=(n_row, n_col),
+    )
+
+    floor_rhs = opt_data["SOC_min"][floor] if len(floor) else np.zeros(0)
+    row_lower = np.concatenate([dyn_rhs, SOC_desired, floor_rhs])
+    row_upper = np.concatenate([dyn_rhs, np.full(n_ev, np.inf), np.full(len(floor), np.inf)])
+
+    return {
+        "c": c,
+        "col_lower": col_lower,
+        "col_upper": col_upper,
+        "A": A,
+        "row_lower": row_lower,
+        "row_upper": row_upper,
+        "n_pairs": n_pairs,
+        "n_ev": n_ev,
+    }
+
+
+def load_lp_arrays(lp, solver_options=None):
+    A = lp["A"]
+
+    highs_lp = highspy.HighsLp()
+    highs_lp.num_col_ = A.shape[1]
+    highs_lp.num_row_ = A.shape[0]
+    highs_lp.col_cost_ = lp["c"]
+    highs_lp.col_lower_ = lp["col_lower"]
+    highs_lp.col_upper_ = lp["col_upper"]
+    highs_lp.row_lower_ = lp["row_lower"]
+    highs_lp.row_upper_ = lp["row_upper"]
+    highs_lp.a_matrix_.format_ = highspy.MatrixFormat.kRowwise
+    highs_lp.a_matrix_.start_ = A.indptr
+    highs_lp.a_matrix_.index_ = A.indices
+    highs_lp.a_matrix_.value_ = A.data
+
+    h = highspy.Highs()
+    h.setOptionValue("output_flag", False)
+    for key, val in (solver_options or {}).items():
+        h.setOptionValue(key, val)
+
+    h.passModel(highs_lp)
+
+    return h
+
+
+# debug export, columns and rows are unnamed (c0, c1, ... / r0, r1, ...)
+def write_lp_arrays(lp, path):
+    load_lp_arrays(lp).writeModel(str(path))
+
+
+def solve_lp_arrays(lp, solver_options=None):
+    h = load_lp_arrays(lp, solver_options)
+    h.run()
+
+    model_status = h.getModelStatus()
+    if model_status != highspy.HighsModelStatus.kOptimal:
+        raise RuntimeError(f"HiGHS did not find an optimal solution: {h.modelStatusToString(model_status)}")
+
+    x = np.asarray(h.getSolution().col_value)
+
+    return x, h.getInfo().objective_function_value
+
+
+def solve_with_highspy(opt_data, solver_options=None):
+    lp = build_lp_arrays(opt_data)
+    x, objective = solve_lp_arrays(lp, solver_options)
+
+    n_pairs = lp["n_pairs"]
+
+    PD_values = x[:n_pairs]
+    SOC_values = x[n_pairs:2*n_pairs]
+    slack_values = x[2*n_pairs:]
+
+    return PD_values, SOC_values, slack_values, objective
+
+
+### Two-stage stochastic bidding LP ###
+# First stage: one day-ahead bid B[t] (kW) shared by all price scenarios.
+# Second stage, per scenario s: the full charging schedule (PD, SOC, slack) and
+# imbalance purchases up[s,t] / sales down[s,t] closing the gap between the
+# fleet load and the bid. Imbalance energy is bought above and sold below the
+# scenario's day-ahead price (imbalance_premium as a share of |price|).
+#
+# Column layout:  [ B (T) | scenario 0: PD, SOC, slack, up, down | scenario 1 ... ]
+# Row layout:     [ scenario 0: SOC dynamics, departure SOC, balance | scenario 1 ... ]
+# The per-scenario block is identical for all scenarios, so the constraint
+# matrix is assembled with Kronecker products instead of per-scenario loops.
+
+def build_stochastic_lp_arrays(opt_data, price_scenarios, imbalance_premium=0.2):
+    lp = build_lp_arrays(opt_data)
+
+    prices = np.asarray(price_scenarios, dtype=float)
+    n_scen, n_hours = prices.shape
+
+    pair_t = opt_data["pair_t"]
+    n_pairs = lp["n_pairs"]
+    n_ev = lp["n_ev"]
+    n_ev_col = 2*n_pairs + n_ev
+    n_ev_row = lp["A"].shape[0]
+
+    # scenario block: EV constraints plus the hourly balance
+    #   sum(PD at t) - B[t] - up[t] + down[t] = 0
+    agg = sp.csr_matrix((np.ones(n_pairs), (pair_t, np.arange(n_pairs))), shape=(n_hours, n_pairs))
+    eye_t = sp.identity(n_hours, format="csr")
+
+    A_scen = sp.bmat([
+        [lp["A"], None, None],
+        [sp.hstack([agg, sp.csr_matrix((n_hours, n_pairs + n_ev))]), -eye_t, eye_t],
+    ], format="csr")
+
+    bid_block = sp.vstack([sp.csr_matrix((n_ev_row, n_hours)), -eye_t], format="csr")
+
+    A = sp.hstack([
+        sp.kron(np.ones((n_scen, 1)), bid_block),
+        sp.kron(sp.identity(n_scen), A_scen),
+    ], format="csr")
+
+    # objective, every scenario weighted 1/n_scen
+    R = opt_data["R"]
+    carbon = opt_data["lambda_carbon"] * (1 - R[pair_t]) / 1000
+
+    ev_cost = np.concatenate([carbon, np.zeros(n_pairs), np.full(n_ev, float(opt_data["SOC_penalty_weight"]))])
+    up_cost = (prices + imbalance_premium*np.abs(prices)) / 1000
+    down_cost = -(prices - imbalance_premium*np.abs(prices)) / 1000
+
+    scen_cost = np.hstack([np.tile(ev_cost, (n_scen, 1)), up_cost, down_cost]) / n_scen
+    c = np.concatenate([prices.mean(axis=0) / 1000, scen_cost.ravel()])
+
+    n_scen_col = n_ev_col + 2*n_hours
+    scen_lower = np.concatenate([lp["col_lower"], np.zeros(2*n_hours)])
+    scen_upper = np.concatenate([lp["col_upper"], np.full(2*n_hours, np.inf)])
+
+    col_lower = np.concatenate([np.zeros(n_hours), np.tile(scen_lower, n_scen)])
+    col_upper = np.concatenate([np.full(n_hours, np.inf), np.tile(scen_upper, n_scen)])
+
+    row_lower = np.tile(np.concatenate([lp["row_lower"], np.zeros(n_hours)]), n_scen)
+    row_upper = np.tile(np.concatenate([lp["row_upper"], np.zeros(n_hours)]), n_scen)
+
+    return {
+        "c": c,
+        "col_lower": col_lower,
+        "col_upper": col_upper,
+        "A": A,
+        "row_lower": row_lower,
+        "row_upper": row_upper,
+        "n_pairs": n_pairs,
+        "n_ev": n_ev,
+        "n_hours": n_hours,
+        "n_scen": n_scen,
+        "n_scen_col": n_scen_col,
+    }
+
+
+def solve_stochastic_with_highspy(opt_data, price_scenarios, imbalance_premium=0.2, solver_options=None):
+    lp = build_stochastic_lp_arrays(opt_data, price_scenarios, imbalance_premium)
+    x, objective = solve_lp_arrays(lp, solver_options)
+
+    n_pairs = lp["n_pairs"]
+    n_ev = lp["n_ev"]
+    n_hours = lp["n_hours"]
+
+    bid = x[:n_hours]
+    scen = x[n_hours:].reshape(lp["n_scen"], lp["n_scen_col"])
+
+    return {
+        "bid": bid,
+        "PD": scen[:, :n_pairs],
+        "SOC": scen[:, n_pairs:2*n_pairs],
+        "slack": scen[:, 2*n_pairs:2*n_pairs + n_ev],
+        "up": scen[:, 2*n_pairs + n_ev:2*n_pairs + n_ev + n_hours],
+        "down": scen[:, 2*n_pairs + n_ev + n_hours:],
+        "objective": objective,
+    }
@@ -0,0 +1,133 @@
+from .utils import *
+import hashlib
+import json
+from xgboost import XGBRegressor
+
+
+### Forecast model registry ###
+# Fitted price models are stored in FORECAST_MODEL_DIR as XGBoost boosters.
+# manifest.json records one entry per model name, feature list and parameter set
+# (the config hash). Each entry holds a hash of the frame the model was trained
+# on: features, target and timestamps.
+#
+# fit_forecast_model then
+#   - reloads the booster when the training frame is unchanged,
+#   - continues boosting the stored model when its training frame is a prefix
+#     of the new one (the daily job only appends hours). incremental_rounds
+#     extra trees are fitted on the appended hours plus incremental_window_hours
+#     of the preceding history,
+#   - otherwise trains from scratch.
+# After max_incremental_updates updates in a row the model is retrained from
+# scratch, so the ensemble does not drift away from a full fit. Only the newest
+# model per name is kept: a model with a new config (tuned parameters, changed
+# features) replaces the entry and booster file of the previous one.
+
+FORECAST_MODEL_VERSION = 1
+
+
+def fit_forecast_model(X_train, y_train, params, name="price", use_registry=True,
+                       incremental_rounds=20, incremental_window_hours=28*24, max_incremental_updates=30):
+    if not use_registry:
+        return train_forecast_model(X_train, y_train, params)
+
+    manifest_path = FORECAST_MODEL_DIR/'manifest.json'
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+
+    config_key = config_hash(name, X_train, params)
+    data_key = frame_hash(X_train, y_train)
+    model_file = FORECAST_MODEL_DIR/f'{config_key}.ubj'
+
+    entry = manifest.get(config_key)
+    if entry is None or not model_file.exists():
+        entry = None
+
+    if entry is not None and entry["data_hash"] == data_key:
+        print(f'Training data unchanged, reusing stored forecast model "{name}" \n')
+        return load_forecast_model(model_file, params)
+
+    n = entry["n_rows"] if entry is not None else 0
+    incremental = (
+        entry is not None
+        and n < len(X_train)
+        and entry["updates"] < max_incremental_updates
+        and frame_hash(X_train.iloc[:n], y_train.iloc[:n]) == entry["data_hash"]
+    )
+
+    if incremental:
+        print(f'Updating stored forecast model "{name}" with {len(X_train) - n} new hours \n')
+
+        base = load_forecast_model(model_file, params)
+        window = slice(max(n - incremental_window_hours, 0), None)
+
+        model = update_forecast_model(base, X_train.iloc[window], y_train.iloc[window], params, incremental_rounds)
+        updates = entry["updates"] + 1
+    else:
+        model = train_forecast_model(X_train, y_train, params)
+        updates = 0
+
+    FORECAST_MODEL_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_file = model_file.with_suffix('.tmp.ubj')
+    model.save_model(tmp_file)
+    os.replace(tmp_file, model_file)
+
+    # models of the same name this one replaces
+    replaced = [key for key, old in manifest.items() if old["name"] == name and key != config_key]
+    for key in replaced:
+        del manifest[key]
+
+    manifest[config_key] = {
+        "name": name,
+        "data_hash": data_key,
+        "n_rows": len(X_train),
+        "last_timestamp": str(X_train.index[-1]),
+        "updates": updates,
+        "features": list(X_train.columns),
+        "params": params,
+    }
+
+    tmp_path = manifest_path.with_suffix('.tmp')
+    tmp_path.write_text(json.dumps(manifest, indent=1, default=str))
+    os.replace(tmp_path, manifest_path)
+
+    for key in replaced:
+        (FORECAST_MODEL_DIR/f'{key}.ubj').unlink(missing_ok=True)
+
+    return model
+
+
+def train_forecast_model(X_train, y_train, params):
+    model = XGBRegressor(**params)
+    model.fit(X_train, y_train)
+    return model
+
+
+# continued boosting: n_rounds extra trees fitted on (X, y)
+def update_forecast_model(model, X, y, params, n_rounds):
+    updated = XGBRegressor(**{**params, "n_estimators": n_rounds})
+    updated.fit(X, y, xgb_model=model.get_booster())
+    return updated
+
+
+def load_forecast_model(model_file, params):
+    model = XGBRegressor(**params)
+    model.load_model(model_file)
+    return model
+
+
+# model name, feature names/dtypes and hyperparameters
+def config_hash(name, X, params):
+    config = {
+        "version": FORECAST_MODEL_VERSION,
+        "name": name,
+        "features": [[col, str(dtype)] for col, dtype in X.dtypes.items()],
+        "params": params,
+    }
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+
+# features, target and index of a training frame
+def frame_hash(X, y):
+    h = hashlib.sha1()
+    h.update(pd.util.hash_pandas_object(X, index=True).to_numpy().tobytes())
+    h.update(pd.util.hash_pandas_object(y, index=False).to_numpy().tobytes())
+    return h.hexdigest()
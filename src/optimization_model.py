@@ -4,30 +4,537 @@ import numpy as np
 from pyomo.environ import *
 import plotly.graph_objects as go
 from highspy import Highs
+from .highs_backend import solve_with_highspy, solve_stochastic_with_highspy, build_lp_arrays, solve_lp_arrays, write_lp_arrays
+from pyomo.contrib.appsi.solvers import Highs as PersistentHighs
+from time import perf_counter
 
 
-def launch_optimization(df_ev_data, df_forecasted):
-    #def ready_the_data(df_ev_data, df_forecasted):
+# Model parameters that can be overridden per run (see scenario_sweep.py)
+DEFAULT_MODEL_PARAMS = {
+    "eta": 0.85,                # charging efficiency
+    "lambda_carbon": 50.0,      # carbon penalty coefficient (EUR/MWh of non-renewable share)
+    "SOC_penalty_weight": 100,  # penalty per kWh of unmet departure SOC
+    "MP": 11.0,                 # max charging power per EV (kW)
+}
+
+HIGHS_OPTIONS = {
+    "presolve": "off",
+    "simplex_strategy": 1,
+    "primal_feasibility_tolerance": 0.0001,
+}
+
+
+# backend="pyomo" builds a ConcreteModel and solves it through SolverFactory,
+# backend="highspy" passes the same LP as sparse arrays straight to highspy.
+# export_lp: optional path, writes the model as an LP file before solving
+# (debugging only, slow for large fleets). The summary carries a "timings"
+# breakdown in seconds.
+def launch_optimization(df_ev_data, df_forecasted, backend="pyomo",
+                        start_ts="2024-12-24 00:00", end_ts="2024-12-31 00:00", model_params=None,
+                        export_lp=None, export_format="parquet"):
+
+    t0 = perf_counter()
+    opt_data = prepare_optimization_data(df_ev_data, df_forecasted, start_ts, end_ts, model_params)
+
+    timings = {"prepare_s": perf_counter() - t0}
+    PD_values, SOC_values = solve_opt_data(opt_data, backend, export_lp=export_lp, timings=timings)
+
+    t1 = perf_counter()
+    summary = summarize_solution(opt_data, PD_values, SOC_values, export_format)
+    timings["summarize_s"] = perf_counter() - t1
+    timings["total_s"] = perf_counter() - t0
+
+    summary["timings"] = timings
+
+    return summary
+
+
+### Rolling horizon optimization ###
+# Solves the season as a sequence of day-ahead windows. Each solve covers
+# window_hours plus lookahead_hours, but only the first window_hours of the
+# schedule are committed. EVs still plugged in at the end of a window carry
+# their committed SOC into the next one. EVs departing beyond the lookahead
+# get a target prorated to the share of their remaining dwell time inside
+# the horizon, so the solver does not defer all of their charging.
+
+def launch_rolling_optimization(df_ev_data, df_forecasted, start_ts, end_ts,
+                                window_hours=24, lookahead_hours=24, backend="highspy", model_params=None,
+                                export_format="parquet"):
+
+    opt_data = prepare_optimization_data(df_ev_data, df_forecasted, start_ts, end_ts, model_params)
+
+    n_hours = opt_data["T_max"] + 1
+    pair_ev = opt_data["pair_ev"]
+    pair_t = opt_data["pair_t"]
+
+    PD_values = np.zeros(len(pair_ev))
+    SOC_values = np.zeros(len(pair_ev))
+
+    # first pair of every EV in the season-level pair arrays
+    lengths = opt_data["departure"] - opt_data["arrival"] + 1
+    pair_start = np.cumsum(lengths) - lengths
+
+    SOC_state = opt_data["SOC_init"].copy()
+
+    for w0 in range(0, n_hours, window_hours):
+        w1 = min(w0 + window_hours, n_hours)
+        h1 = min(w1 + lookahead_hours, n_hours)
+
+        print(f'Solving window {w0}-{w1} (horizon to {h1}) \n')
+
+        win_data, win_evs = slice_horizon(opt_data, w0, h1, SOC_state)
+        if len(win_evs) == 0:
+            continue
+
+        win_PD, win_SOC = solve_opt_data(win_data, backend)
+
+        # commit the first window_hours and map them back onto the season pairs
+        win_t = win_data["pair_t"] + w0
+        commit = win_t < w1
+        ev_global = win_evs[win_data["pair_ev"][commit]]
+        idx = pair_start[ev_global] + (win_t[commit] - opt_data["arrival"][ev_global])
+
+        PD_values[idx] = win_PD[commit]
+        SOC_values[idx] = win_SOC[commit]
+
+        # SOC carried over by EVs that are still plugged in after w1
+        at_end = commit & (win_t == w1 - 1)
+        SOC_state[win_evs[win_data["pair_ev"][at_end]]] = win_SOC[at_end]
+
+    return summarize_solution(opt_data, PD_values, SOC_values, export_format)
+
+
+### Stochastic day-ahead bidding ###
+# price_scenarios: DataFrame indexed like df_forecasted, one column per price
+# scenario (see data_forecasting.generate_price_scenarios). Solves one LP with
+# a shared day-ahead bid and per-scenario charging/imbalance recourse.
+# Every scenario adds a copy of the full EV x hour model, so the solve time grows
+# somewhat faster than linearly in the number of scenarios. On the week-long
+# 300 EV/day benchmark (benchmarks/stochastic_benchmark.py) it takes about
+# 12 s with 5 scenarios, 60 s with 20 and 3.5 min with 50.
+
+def launch_stochastic_optimization(df_ev_data, df_forecasted, price_scenarios,
+                                   start_ts="2024-12-24 00:00", end_ts="2024-12-31 00:00",
+                                   imbalance_premium=0.2, model_params=None):
+
+    opt_data = prepare_optimization_data(df_ev_data, df_forecasted, start_ts, end_ts, model_params)
+
+    timestamps = opt_data["df_fc"]["timestamp"]
+    scenarios = price_scenarios.reindex(timestamps)
+    if scenarios.isna().any().any():
+        raise ValueError("Price scenarios do not cover the optimization window.")
+
+    prices = scenarios.to_numpy(dtype=float).T
+
+    print(f'starting stochastic solver with {prices.shape[0]} price scenarios \n')
+
+    # HiGHS defaults here: with presolve on, the scenario copies of the EV
+    # block are reduced far better than with the deterministic settings
+    sol = solve_stochastic_with_highspy(opt_data, prices, imbalance_premium)
+
+    # realised market cost of the bid plus imbalance settlement per scenario
+    up_price = prices + imbalance_premium*np.abs(prices)
+    down_price = prices - imbalance_premium*np.abs(prices)
+    scenario_costs = (
+        prices @ sol["bid"] + (up_price*sol["up"]).sum(axis=1) - (down_price*sol["down"]).sum(axis=1)
+    ) / 1000
+
+    tardy = [solution_metrics(opt_data, PD, SOC)["num_ev_tardy"] for PD, SOC in zip(sol["PD"], sol["SOC"])]
+
+    summary = {
+        "expected_cost": float(scenario_costs.mean()),
+        "scenario_costs": scenario_costs,
+        "expected_num_ev_tardy": float(np.mean(tardy)),
+        "bid_kw": pd.Series(sol["bid"], index=pd.DatetimeIndex(timestamps), name="bid_kW"),
+        "objective": sol["objective"],
+        "PD_values": sol["PD"],
+        "SOC_values": sol["SOC"],
+    }
+
+    return summary
+
+
+### Fleet-aggregated (virtual battery) mode ###
+# EVs departing in the same hour are merged into one cohort, modelled as a
+# virtual battery through aggregate envelopes over the cohort's hours:
+#   PD_max[t]   sum of the members' power limits at t
+#   SOC_max[t]  most energy the members can have stored by t (power and capacity)
+#   SOC_min[t]  least energy that must be stored by t for every member to still
+#               reach its target (soft, shares the cohort's departure slack)
+# The cohort LP has at most one "EV" per hour of the horizon and is solved by the
+# same highspy backend. The cohort schedule is split back onto the members
+# hour by hour (disaggregate_schedule).
+#
+# Every per-EV schedule aggregates to a feasible cohort schedule at no higher
+# objective, so the cohort LP objective is a lower bound on the exact optimum.
+# The objective of the disaggregated schedule is an upper bound, and
+# "gap_bound" is therefore a guaranteed bound on the cost gap. With
+# compare_exact=True the exact per-EV LP is solved as well and the true gap is
+# reported.
+
+def launch_aggregated_optimization(df_ev_data, df_forecasted,
+                                   start_ts="2024-12-24 00:00", end_ts="2024-12-31 00:00",
+                                   compare_exact=False, model_params=None):
+
+    t0 = perf_counter()
+    opt_data = prepare_optimization_data(df_ev_data, df_forecasted, start_ts, end_ts, model_params)
+
+    t1 = perf_counter()
+    cohort_data, cohort_of_ev, unreachable = aggregate_cohorts(opt_data)
+
+    t2 = perf_counter()
+    cohort_PD, _, _, cohort_objective = solve_with_highspy(cohort_data, HIGHS_OPTIONS)
+    # targets no schedule can reach are penalised in every model alike
+    lower_bound = cohort_objective + opt_data["SOC_penalty_weight"] * unreachable
+
+    t3 = perf_counter()
+    PD_values, SOC_values = disaggregate_schedule(opt_data, cohort_data, cohort_of_ev, cohort_PD)
+    upper_bound = schedule_objective(opt_data, PD_values, SOC_values)
+
+    t4 = perf_counter()
+
+    summary = {
+        **solution_metrics(opt_data, PD_values, SOC_values),
+        "num_ev": len(opt_data["EV_list"]),
+        "num_cohorts": len(cohort_data["EV_list"]),
+        "objective": upper_bound,
+        "objective_lower_bound": lower_bound,
+        "gap_bound": (upper_bound - lower_bound) / abs(lower_bound) if lower_bound else 0.0,
+        "timings": {
+            "prepare_s": t1 - t0,
+            "aggregate_s": t2 - t1,
+            "solve_s": t3 - t2,
+            "disaggregate_s": t4 - t3,
+            "total_s": t4 - t0,
+        },
+        "PD_values": PD_values,
+        "SOC_values": SOC_values,
+    }
+
+    if compare_exact:
+        _, _, _, exact_objective = solve_with_highspy(opt_data, HIGHS_OPTIONS)
+        summary["exact_objective"] = exact_objective
+        summary["gap"] = (upper_bound - exact_objective) / abs(exact_objective) if exact_objective else 0.0
+
+    return summary
+
+
+def aggregate_cohorts(opt_data):
+    pair_ev = opt_data["pair_ev"]
+    pair_t = opt_data["pair_t"]
+    eta = opt_data["eta"]
+    n_ev = len(opt_data["EV_list"])
+    n_hours = opt_data["T_max"] + 1
+
+    cohort_of_ev = opt_data["departure"].copy()
+
+    limit = opt_data["MP"][pair_ev] * opt_data["avail"]
+
+    # power drawable by each pair's hour (inclusive) and after it, per EV
+    ev_total = np.bincount(pair_ev, weights=limit, minlength=n_ev)
+    ev_before = np.cumsum(ev_total) - ev_total
+    drawn_by = np.cumsum(limit) - ev_before[pair_ev]
+    later = ev_total[pair_ev] - drawn_by
+
+    headroom = np.maximum(opt_data["MC"] - opt_data["SOC_init"], 0.0)
+    need = np.maximum(opt_data["SOC_desired"] - opt_data["SOC_init"], 0.0)
+    reachable_need = np.minimum(need, np.minimum(eta*ev_total, headroom))
+    unreachable = float((need - reachable_need).sum())
+
+    gain_max = np.minimum(eta*drawn_by, headroom[pair_ev])
+    gain_min = np.maximum(reachable_need[pair_ev] - eta*later, 0.0)
+
+    # cohort envelopes on the (departure hour, hour) grid
+    cell = cohort_of_ev[pair_ev]*n_hours + pair_t
+
+    def cell_sum(values):
+        return np.bincount(cell, weights=values, minlength=n_hours*n_hours)
+
+    cohorts = np.unique(cohort_of_ev)
+    first_arrival = np.full(n_hours, n_hours)
+    np.minimum.at(first_arrival, cohort_of_ev, opt_data["arrival"])
+
+    arrival = first_arrival[cohorts]
+    departure = cohorts
+    ones = np.ones(len(cohorts))
+    c_pair_ev, c_pair_t, _ = expand_dwell_windows(arrival, departure, ones, ones)
+    c_cell = cohorts[c_pair_ev]*n_hours + c_pair_t
+
+    cohort_data = {
+        "T_max": opt_data["T_max"],
+        "EV_list": np.array([f"cohort_dep_{t}" for t in cohorts], dtype=object),
+        "pair_ev": c_pair_ev,
+        "pair_t": c_pair_t,
+        "avail": ones[c_pair_ev],
+        "PD_max": cell_sum(limit)[c_cell],
+        "SOC_max": cell_sum(gain_max)[c_cell],
+        "SOC_min": cell_sum(gain_min)[c_cell],
+        "price": opt_data["price"],
+        "R": opt_data["R"],
+        "arrival": arrival,
+        "departure": departure,
+        "SOC_init": np.zeros(len(cohorts)),
+        "SOC_desired": np.bincount(cohort_of_ev, weights=reachable_need, minlength=n_hours)[cohorts],
+        "MC": np.bincount(cohort_of_ev, weights=headroom, minlength=n_hours)[cohorts],
+        "MP": ones,
+        "eta": eta,
+        "lambda_carbon": opt_data["lambda_carbon"],
+        "SOC_penalty_weight": opt_data["SOC_penalty_weight"],
+    }
+
+    # members indexed by cohort position rather than departure hour
+    cohort_of_ev = np.searchsorted(cohorts, cohort_of_ev)
+
+    return cohort_data, cohort_of_ev, unreachable
+
+
+# Split each cohort's hourly power over the members present in that hour.
+# Members first get the energy they can no longer receive in later hours
+# (least laxity), even if that exceeds the cohort plan: the aggregate LP lets
+# one member's surplus offset another's shortfall, and buying a little extra
+# is far cheaper than the SOC penalty. The rest of the cohort power is split
+# proportionally to the remaining need, capped by the member's power and
+# battery limits, with a few water-filling passes for power a member cannot
+# take. Runs hour by hour, vectorized over all pairs of the hour.
+def disaggregate_schedule(opt_data, cohort_data, cohort_of_ev, cohort_PD, n_passes=3):
+    pair_ev = opt_data["pair_ev"]
+    pair_t = opt_data["pair_t"]
+    eta = opt_data["eta"]
+    n_cohorts = len(cohort_data["EV_list"])
+
+    # cohort power per (cohort, hour)
+    cohort_power = np.zeros((n_cohorts, opt_data["T_max"] + 1))
+    cohort_power[cohort_data["pair_ev"], cohort_data["pair_t"]] = cohort_PD
+
+    PD_values = np.zeros(len(pair_ev))
+    SOC_values = np.zeros(len(pair_ev))
+    SOC = opt_data["SOC_init"].copy()
+
+    limit = opt_data["MP"][pair_ev] * opt_data["avail"]
+
+    # power the EV can still draw after each pair's hour (pairs of an EV are contiguous)
+    ev_total = np.bincount(pair_ev, weights=limit, minlength=len(SOC))
+    ev_before = np.cumsum(ev_total) - ev_total
+    later_limit = ev_total[pair_ev] - (np.cumsum(limit) - ev_before[pair_ev])
+
+    order = np.argsort(pair_t, kind="stable")
+    bounds = np.searchsorted(pair_t[order], np.arange(opt_data["T_max"] + 2))
+
+    for t in range(opt_data["T_max"] + 1):
+        k = order[bounds[t]:bounds[t + 1]]
+        if len(k) == 0:
+            continue
+
+        ev = pair_ev[k]
+        cohort = cohort_of_ev[ev]
+
+        cap = np.minimum(limit[k], np.maximum(opt_data["MC"][ev] - SOC[ev], 0.0) / eta)
+        need = np.minimum(np.maximum(opt_data["SOC_desired"][ev] - SOC[ev], 0.0) / eta, cap + later_limit[k])
+
+        alloc = np.clip(need - later_limit[k], 0.0, cap)
+        remaining = np.maximum(cohort_power[:, t] - np.bincount(cohort, weights=alloc, minlength=n_cohorts), 0.0)
+
+        for _ in range(n_passes):
+            room = cap - alloc
+            # weight by remaining need first, fall back to free capacity
+            weight = np.where((room > 1e-9) & (need - alloc > 1e-9), need - alloc, 0.0)
+            w_sum = np.bincount(cohort, weights=weight, minlength=n_cohorts)
+            no_need = w_sum[cohort] <= 1e-9
+            weight = np.where(no_need, room, weight)
+            w_sum = np.bincount(cohort, weights=weight, minlength=n_cohorts)
+
+            share = np.divide(weight * remaining[cohort], w_sum[cohort],
+                              out=np.zeros(len(k)), where=w_sum[cohort] > 1e-9)
+            share = np.minimum(share, room)
+            alloc += share
+            remaining -= np.bincount(cohort, weights=share, minlength=n_cohorts)
+
+            if remaining.max(initial=0.0) <= 1e-9:
+                break
+
+        SOC[ev] += eta * alloc
+        PD_values[k] = alloc
+        SOC_values[k] = SOC[ev]
+
+    return PD_values, SOC_values
+
+
+# Objective of a given per-EV schedule, same terms as obj_rule
+def schedule_objective(opt_data, PD_values, SOC_values):
+    pair_t = opt_data["pair_t"]
+    cost = (opt_data["price"][pair_t] + opt_data["lambda_carbon"] * (1 - opt_data["R"][pair_t])) / 1000
+
+    at_departure = pair_t == opt_data["departure"][opt_data["pair_ev"]]
+    shortfall = np.maximum(opt_data["SOC_desired"][opt_data["pair_ev"][at_departure]] - SOC_values[at_departure], 0.0)
+
+    return float(cost @ PD_values + opt_data["SOC_penalty_weight"] * shortfall.sum())
+
+
+# Restrict the prepared season data to hours [h0, h1), re-indexed from 0.
+# EVs that arrived before h0 start from SOC_state at h0.
+def slice_horizon(opt_data, h0, h1, SOC_state):
+    t_a = opt_data["arrival"]
+    t_d = opt_data["departure"]
+
+    win_evs = np.flatnonzero((t_a < h1) & (t_d >= h0))
+
+    t_a = t_a[win_evs]
+    t_d = t_d[win_evs]
+    carried = t_a < h0
+    truncated = t_d >= h1
+
+    w_a = np.maximum(t_a, h0)
+    w_d = np.minimum(t_d, h1 - 1)
+
+    frac_a = np.where(carried, 1.0, opt_data["frac_a"][win_evs])
+    frac_d = np.where(truncated, 1.0, opt_data["frac_d"][win_evs])
+
+    SOC_init = np.where(carried, SOC_state[win_evs], opt_data["SOC_init"][win_evs])
+
+    SOC_desired = opt_data["SOC_desired"][win_evs]
+    share_in_horizon = (h1 - w_a) / (t_d + 1 - w_a)
+    SOC_desired = np.where(
+        truncated,
+        SOC_init + (SOC_desired - SOC_init) * share_in_horizon,
+        SOC_desired,
+    )
+
+    pair_ev, pair_t, avail = expand_dwell_windows(w_a - h0, w_d - h0, frac_a, frac_d)
+
+    win_data = {
+        "T_max": h1 - h0 - 1,
+        "EV_list": opt_data["EV_list"][win_evs],
+        "pair_ev": pair_ev,
+        "pair_t": pair_t,
+        "avail": avail,
+        "price": opt_data["price"][h0:h1],
+        "R": opt_data["R"][h0:h1],
+        "arrival": w_a - h0,
+        "departure": w_d - h0,
+        "frac_a": frac_a,
+        "frac_d": frac_d,
+        "SOC_init": SOC_init,
+        "SOC_desired": SOC_desired,
+        "MC": opt_data["MC"][win_evs],
+        "MP": opt_data["MP"][win_evs],
+        "eta": opt_data["eta"],
+        "lambda_carbon": opt_data["lambda_carbon"],
+        "SOC_penalty_weight": opt_data["SOC_penalty_weight"],
+    }
+
+    return win_data, win_evs
+
+
+# timings: optional dict, filled with the build / write / solve / extract times
+def solve_opt_data(opt_data, backend="pyomo", export_lp=None, timings=None):
+    if timings is None:
+        timings = {}
+
+    t0 = perf_counter()
+
+    if backend == "pyomo":
+        model = build_model(opt_data)
+        t1 = perf_counter()
+
+        if export_lp:
+            model.write(str(export_lp), io_options={"symbolic_solver_labels": True})
+        t2 = perf_counter()
+
+        #solver = SolverFactory('highs')
+        solver = SolverFactory("highs")
+        for key, val in HIGHS_OPTIONS.items():
+            solver.options[key] = val
+
+
+        #print("Solver type:", type(solver))
+
+        print('solver defined \n')
+
+        print('starting solver \n')
+
+        results = solver.solve(model, tee=False)
+        t3 = perf_counter()
+        # Results
+
+        PD_values = extract_pair_values(model.PD)
+        SOC_values = extract_pair_values(model.SOC)
+
+    elif backend == "highspy":
+        lp = build_lp_arrays(opt_data)
+        t1 = perf_counter()
+
+        if export_lp:
+            write_lp_arrays(lp, export_lp)
+        t2 = perf_counter()
+
+        print('starting solver \n')
+
+        x, _ = solve_lp_arrays(lp, HIGHS_OPTIONS)
+        t3 = perf_counter()
+
+        n_pairs = lp["n_pairs"]
+        PD_values = x[:n_pairs]
+        SOC_values = x[n_pairs:2*n_pairs]
+
+    else:
+        raise ValueError(f"Unknown optimization backend: {backend}")
+
+    t4 = perf_counter()
+
+    timings["build_s"] = t1 - t0
+    timings["write_s"] = t2 - t1
+    timings["solve_s"] = t3 - t2
+    timings["extract_s"] = t4 - t3
+
+    return PD_values, SOC_values
+
+
+def summarize_solution(opt_data, PD_values, SOC_values, export_format="parquet"):
+    df_fc = opt_data["df_fc"]
+    df_ev = opt_data["df_ev"]
+
+    new_cost = compute_cost_new(opt_data, PD_values)
+    #print("NEW MODEL monetary charging cost:", new_cost)
+
+    export_visualization_data(df_fc, df_ev, opt_data, PD_values, SOC_values, export_format)
+
+    tardy = calculate_tardiness(opt_data, SOC_values)
+
+    summary = {
+        "total_charging_cost": new_cost,
+        "carbon_cost": compute_carbon_cost(opt_data, PD_values),
+        "num_ev_tardy": len(tardy),
+        "tardiness_details": tardy,
+        "hourly_load_kW": pd.Series(hourly_load(opt_data, PD_values), index=pd.DatetimeIndex(df_fc["timestamp"]), name="load_kW"),
+        "PD_values": PD_values,
+        "SOC_values": SOC_values,
+    }
+
+    return summary
+
+
+
+def prepare_optimization_data(df_ev_data, df_forecasted,
+                              start_ts="2024-12-24 00:00", end_ts="2024-12-31 00:00", model_params=None):
+    params = {**DEFAULT_MODEL_PARAMS, **(model_params or {})}
+
     df_ev = df_ev_data.copy()
     df_fc = df_forecasted.copy().reset_index(drop=False)
     #df_fc = df_fc.reset_index(drop=False)
 
-    df_ev['toa'] = pd.to_datetime(df_ev['toa'])
-    df_ev['tod'] = pd.to_datetime(df_ev['tod'])
+    # bounds given without a time zone are read in the forecast's time zone
+    tz = df_forecasted.index.tz
+    start_ts = as_timeline_time(start_ts, tz)
+    end_ts   = as_timeline_time(end_ts, tz)
 
-    start_ts = pd.Timestamp("2024-12-24 00:00")
-    end_ts   = pd.Timestamp("2024-12-31 00:00")
-
-    df_ev["toa_hr"] = df_ev["toa"].dt.floor("h")
-    df_ev["tod_hr"] = df_ev["tod"].dt.floor("h")
+    df_ev["toa_hr"] = floor_to_hour(df_ev["toa"])
+    df_ev["tod_hr"] = floor_to_hour(df_ev["tod"])
 
     df_ev = df_ev[
         (df_ev["toa_hr"] >= start_ts) &
         (df_ev["tod_hr"] <  end_ts)
     ].copy()
 
-    df_fc['timestamp'] = pd.to_datetime(df_fc['timestamp'])
-
     df_fc = df_fc[(df_fc["timestamp"] >= start_ts) &
               (df_fc["timestamp"] <  end_ts)].copy()
 
@@ -37,7 +544,7 @@ def launch_optimization(df_ev_data, df_forecasted):
 
     time_to_idx = {ts: idx for idx, ts in enumerate(df_fc['timestamp'])}
 
-    price_dict = {t: df_fc.loc[t, "forecasted_prices"] for t in range(T_max+1)}
+    price = df_fc["forecasted_prices"].to_numpy(dtype=float)
 
     df_fc['total_gen'] = (
         df_fc['solar_generation'] +
@@ -53,102 +560,132 @@ def launch_optimization(df_ev_data, df_forecasted):
         df_fc['wind_off_generation']
     ) / df_fc['total_gen'].replace(0, np.nan)
 
-    R_dict = {
-        t: float(df_fc.loc[t, 'R']) for t in range(T_max+1)
+    R = df_fc['R'].to_numpy(dtype=float)
+
+    # only a handful of distinct dates, so format those once and broadcast
+    date_codes, dates = pd.factorize(df_ev['date'])
+    df_ev['unique_ev'] = df_ev['ev_id'] + '_' + pd.DatetimeIndex(dates).strftime('%Y-%m-%d').to_numpy()[date_codes]
+
+    EV_list = df_ev['unique_ev'].to_numpy()
+
+    # hour indices of arrival and departure on the forecast timeline (int64 ns)
+    timestamps = pd.DatetimeIndex(df_fc['timestamp']).as_unit('ns').asi8
+    arrival = hour_index(timestamps, pd.DatetimeIndex(df_ev['toa_hr']).as_unit('ns').asi8)
+    departure = hour_index(timestamps, pd.DatetimeIndex(df_ev['tod_hr']).as_unit('ns').asi8)
+
+    # fraction of the arrival/departure hour the EV is actually plugged in
+    toa_min = pd.DatetimeIndex(df_ev['toa']).as_unit('ns').asi8 // 60_000_000_000 % 60
+    tod_min = pd.DatetimeIndex(df_ev['tod']).as_unit('ns').asi8 // 60_000_000_000 % 60
+    frac_a = np.where(toa_min != 0, (60 - toa_min)/60, 1.0)
+    frac_d = np.where(tod_min != 0, tod_min/60, 0.0)
+
+    pair_ev, pair_t, avail = expand_dwell_windows(arrival, departure, frac_a, frac_d)
+
+    cap = df_ev['max_battery_capacity'].to_numpy(dtype=float)
+
+    opt_data = {
+        "df_ev": df_ev,
+        "df_fc": df_fc,
+        "time_to_idx": time_to_idx,
+        "T_max": T_max,
+        "EV_list": EV_list,
+        "pair_ev": pair_ev,
+        "pair_t": pair_t,
+        "avail": avail,
+        "price": price,
+        "R": R,
+        "arrival": arrival,
+        "departure": departure,
+        "frac_a": frac_a,
+        "frac_d": frac_d,
+        "SOC_init": df_ev['i_soc'].to_numpy(dtype=float) / 100.0 * cap,
+        "SOC_desired": df_ev['d_soc'].to_numpy(dtype=float) / 100.0 * cap,
+        "MC": cap,
+        "MP": np.full(len(EV_list), float(params["MP"])),
+        "eta": params["eta"],
+        "lambda_carbon": params["lambda_carbon"],
+        "SOC_penalty_weight": params["SOC_penalty_weight"],
     }
 
-    df_ev['unique_ev'] = df_ev['ev_id'] + '_' + df_ev['date'].astype(str)
-
-    EV_list = df_ev['unique_ev'].tolist()
-
-
-    #SOC_init_energy = {}
-    #SOC_desired_energy = {}
-    arrival = {}
-    departure = {}
-    SOC_init = {}
-    SOC_desired = {}
-    MC = {}
-    MP = {}
-    availability = {}
-    T_ev_pairs = []
-
+    return opt_data
 
-    for _, row in df_ev.iterrows():
-        ev = row['unique_ev']
-        toa = row["toa"]
-        tod = row["tod"]
-        cap = float(row['max_battery_capacity'])
 
+# Position of each (hour-floored) timestamp on the sorted forecast timeline
+def hour_index(timestamps, hours):
+    idx = np.searchsorted(timestamps, hours)
+    if len(hours) and (idx.max() >= len(timestamps) or (timestamps[idx] != hours).any()):
+        raise ValueError("EV arrival/departure hours are missing from the forecast timeline.")
+    return idx
 
-        #t_a = time_to_idx.get(pd.Timestamp(toa.))
 
-        t_a = time_to_idx.get(pd.Timestamp(toa.replace(minute=0, second=0)))
-        t_d = time_to_idx.get(pd.Timestamp(tod.replace(minute=0, second=0)))
-        #T_ev_init[ev] = list(range(int(t_a), int(t_d)+1))
+# Expand per-EV dwell windows [t_a, t_d] into flat EV-hour pair arrays.
+# Pairs of one EV are contiguous and ordered by hour; the arrival and
+# departure hours are only partially available.
+def expand_dwell_windows(t_a, t_d, frac_a, frac_d):
+    lengths = t_d - t_a + 1
+    pair_ev = np.repeat(np.arange(len(t_a)), lengths)
+    starts = np.cumsum(lengths) - lengths
+    pair_t = t_a[pair_ev] + (np.arange(len(pair_ev)) - starts[pair_ev])
 
-        for t in range(int(t_a), int(t_d)+1):
-            T_ev_pairs.append((ev, t))
+    is_first = pair_t == t_a[pair_ev]
+    is_last = pair_t == t_d[pair_ev]
 
-        #print(ev, t_a, t_d)
+    avail = np.ones(len(pair_ev))
+    avail[is_first] = frac_a[pair_ev[is_first]]
+    avail[is_last] = frac_d[pair_ev[is_last]]
+    both = is_first & is_last
+    avail[both] = np.minimum(frac_a, frac_d)[pair_ev[both]]
 
-        frac_a = (60 - toa.minute)/60 if toa.minute != 0 else 1.0
-        frac_d = tod.minute/60 if tod.minute != 0 else 0.0
+    return pair_ev, pair_t, avail
 
 
-        for t in range(T_max + 1):
-            if t < t_a:
-                availability[(ev, t)] = 0
-            elif t == t_a == t_d:
-                availability[(ev, t)] = min(frac_a, frac_d)
-            elif t == t_a:
-                availability[(ev, t)] = frac_a
-            elif t_a < t < t_d:
-                availability[(ev, t)] = 1
-            elif t == t_d:
-                availability[(ev, t)] = frac_d
-            else:
-                availability[(ev, t)] = 0
+# (hour -> EVs present) index, grouped from the pair arrays in one pass
+def evs_at_hour(opt_data):
+    order = np.argsort(opt_data["pair_t"], kind="stable")
+    counts = np.bincount(opt_data["pair_t"], minlength=opt_data["T_max"] + 1)
+    ev_names = opt_data["EV_list"][opt_data["pair_ev"][order]]
+    return dict(enumerate(np.split(ev_names, np.cumsum(counts)[:-1])))
 
-        #print('-----------------------------------------')
-        
 
-        arrival[ev] = t_a
-        departure[ev] = t_d
-        SOC_init[ev] = row['i_soc'] / 100.0 * cap
-        SOC_desired[ev] = row['d_soc'] / 100.0 * cap
-        MC[ev] = float(row['max_battery_capacity'])
-        MP[ev] = 11.0
 
-
-    ## Model
+## Model
+# mutable=True makes price, R and lambda_carbon mutable Params so they can be
+# updated in place and re-solved through a persistent solver.
+def build_model(opt_data, mutable=False):
+    EV_list = opt_data["EV_list"]
+    pair_names = EV_list[opt_data["pair_ev"]]
+    T_ev_pairs = list(zip(pair_names, opt_data["pair_t"].tolist()))
 
     model = ConcreteModel()
 
-    model.EV = Set(initialize=EV_list)
-    model.T = RangeSet(0, T_max)
+    model.EV = Set(initialize=EV_list.tolist())
+    model.T = RangeSet(0, opt_data["T_max"])
     model.T_EV = Set(dimen=2, initialize=T_ev_pairs)
+    model.EV_at_T = Set(model.T, initialize=evs_at_hour(opt_data))
 
     # parameters
-    model.price = Param(model.T, initialize=price_dict, within=Reals)
-    model.R = Param(model.T, initialize=R_dict, within=NonNegativeReals)
+    model.price = Param(model.T, initialize=dict(enumerate(opt_data["price"])), within=Reals, mutable=mutable)
+    model.R = Param(model.T, initialize=dict(enumerate(opt_data["R"])), within=NonNegativeReals, mutable=mutable)
 
     # EV parameters
-    model.MP = Param(model.EV, initialize=MP)
-    model.MC = Param(model.EV, initialize=MC)
+    model.MP = Param(model.EV, initialize=dict(zip(EV_list, opt_data["MP"])))
+    model.MC = Param(model.EV, initialize=dict(zip(EV_list, opt_data["MC"])))
 
-    model.SOC_init = Param(model.EV, initialize=SOC_init)
-    model.SOC_desired = Param(model.EV, initialize=SOC_desired)
+    model.SOC_init = Param(model.EV, initialize=dict(zip(EV_list, opt_data["SOC_init"])))
+    model.SOC_desired = Param(model.EV, initialize=dict(zip(EV_list, opt_data["SOC_desired"])))
 
-    model.arrival = Param(model.EV, initialize=arrival)
-    model.departure = Param(model.EV, initialize=departure)
+    model.arrival = Param(model.EV, initialize=dict(zip(EV_list, opt_data["arrival"].tolist())))
+    model.departure = Param(model.EV, initialize=dict(zip(EV_list, opt_data["departure"].tolist())))
 
-    model.avail = Param(model.EV, model.T, initialize=availability)
+    model.avail = Param(model.T_EV, initialize=dict(zip(T_ev_pairs, opt_data["avail"])))
 
-    model.eta = Param(initialize=0.85)
+    model.eta = Param(initialize=opt_data["eta"])
 
     # Carbon penalty coefficient
-    model.lambda_carbon = Param(initialize=50.0)  
+    model.lambda_carbon = Param(initialize=opt_data["lambda_carbon"], mutable=mutable)
+
+    # Penalty on unmet departure SOC
+    model.SOC_penalty_weight = Param(initialize=opt_data["SOC_penalty_weight"])
 
     # Decision variables
     model.PD = Var(model.T_EV, within=NonNegativeReals)
@@ -182,60 +719,91 @@ def launch_optimization(df_ev_data, df_forecasted):
 
     model.DepSOC = Constraint(model.EV, rule=dep_rule)
 
-    model.write("model.lp", io_options={"symbolic_solver_labels": True})
-
-    #solver = SolverFactory('highs')
-    solver = SolverFactory("highs")
-    solver.options["presolve"] = "off"
-    solver.options["simplex_strategy"] = 1
-    solver.options["primal_feasibility_tolerance"] = 0.0001
-
-
-    #print("Solver type:", type(solver))
+    return model
+
+
+### Persistent model for what-if re-solves ###
+# Builds the Pyomo model once with mutable price, R and lambda_carbon and keeps
+# it loaded in a persistent HiGHS instance. Only the objective depends on these
+# parameters, so after update() HiGHS re-solves from the previous optimal basis
+# instead of rebuilding and re-reading the model.
+#
+#   pm = PersistentChargingModel(df_ev_data, df_forecasted)
+#   base = pm.solve()
+#   pm.update(price=actual_prices)
+#   actual = pm.solve()
+
+class PersistentChargingModel:
+
+    def __init__(self, df_ev_data, df_forecasted, start_ts="2024-12-24 00:00",
+                 end_ts="2024-12-31 00:00", model_params=None):
+        self.opt_data = prepare_optimization_data(df_ev_data, df_forecasted, start_ts, end_ts, model_params)
+        self.opt_data["price"] = self.opt_data["price"].copy()
+        self.opt_data["R"] = self.opt_data["R"].copy()
+
+        self.model = build_model(self.opt_data, mutable=True)
+
+        self.solver = PersistentHighs()
+        self.solver.highs_options.update(HIGHS_OPTIONS)
+        self.n_solves = 0
+
+    def update(self, price=None, R=None, lambda_carbon=None):
+        n_hours = self.opt_data["T_max"] + 1
+
+        if price is not None:
+            price = np.asarray(price, dtype=float)
+            if len(price) != n_hours:
+                raise ValueError(f"Expected {n_hours} hourly prices, got {len(price)}.")
+            self.model.price.store_values(dict(enumerate(price)))
+            self.opt_data["price"] = price
+
+        if R is not None:
+            R = np.asarray(R, dtype=float)
+            if len(R) != n_hours:
+                raise ValueError(f"Expected {n_hours} hourly renewable shares, got {len(R)}.")
+            self.model.R.store_values(dict(enumerate(R)))
+            self.opt_data["R"] = R
+
+        if lambda_carbon is not None:
+            self.model.lambda_carbon.set_value(float(lambda_carbon))
+            self.opt_data["lambda_carbon"] = float(lambda_carbon)
+
+    def solve(self):
+        if self.n_solves:
+            # the structure never changes between solves, only parameter values
+            cfg = self.solver.update_config
+            cfg.check_for_new_or_removed_constraints = False
+            cfg.check_for_new_or_removed_vars = False
+            cfg.check_for_new_or_removed_params = False
+            cfg.check_for_new_objective = False
+            cfg.update_constraints = False
+            cfg.update_vars = False
+            cfg.update_named_expressions = False
+
+        t0 = perf_counter()
+        results = self.solver.solve(self.model)
+        solve_time = perf_counter() - t0
+        self.n_solves += 1
+
+        PD_values = extract_pair_values(self.model.PD)
+        SOC_values = extract_pair_values(self.model.SOC)
+
+        return {
+            **solution_metrics(self.opt_data, PD_values, SOC_values),
+            "objective": results.best_feasible_objective,
+            "solve_time_s": solve_time,
+            "PD_values": PD_values,
+            "SOC_values": SOC_values,
+        }
 
-    print('solver defined \n')
 
-    print('starting solver \n')
-
-    results = solver.solve(model, tee=False)
-    # Results
-
-    PD_solution = {(ev, t): value(model.PD[ev, t]) 
-               for (ev, t) in model.T_EV}
-
-    SOC_solution = {(ev, t): value(model.SOC[ev, t]) 
-                    for (ev, t) in model.T_EV}
-    
-    new_cost = compute_cost_new(df_fc, PD_solution, model, time_to_idx)
-    #print("NEW MODEL monetary charging cost:", new_cost)
-
-    export_visualization_data(df_fc, df_ev, model, PD_solution, SOC_solution)
-    #export_visualization_data(df_fc, model, PD_solution, SOC_solution)
-
-    tardy = calculate_tardiness(model)
-
-    #if tardy==None:
-    #    tardy = 0
-
-    summary = {
-        "total_charging_cost": new_cost,
-        "num_ev_tardy": len(tardy),
-        "tardiness_details": tardy,
-    }
-
-    return summary
-
-
-    
 ## Objective
 def obj_rule(m):
-    SOC_penalty_weight = 100
-
     return sum(
         (m.price[t] + m.lambda_carbon * (1 - m.R[t])) *
-        (sum(m.PD[ev, t] for (ev, tt) in m.T_EV if tt == t) / 1000)
+        (sum(m.PD[ev, t] for ev in m.EV_at_T[t]) / 1000)
         for t in m.T
-    ) + SOC_penalty_weight * sum(m.slack[ev] for ev in m.EV)
+    ) + m.SOC_penalty_weight * sum(m.slack[ev] for ev in m.EV)
 
 
 ## Constraints
@@ -261,51 +829,103 @@ def dep_rule(m, ev):
     return m.SOC[ev, t_d] + m.slack[ev] >= m.SOC_desired[ev]
 
 
+# Fleet load per hour (kW) and the cost/tardiness figures used to compare runs
+def solution_metrics(opt_data, PD_values, SOC_values, tol=1e-3):
+    load = hourly_load(opt_data, PD_values)
+    shortfall = departure_shortfall(opt_data, SOC_values)
+
+    total_charging_cost = compute_cost_new(opt_data, PD_values)
+
+    return {
+        "total_charging_cost": total_charging_cost,
+        "carbon_weighted_cost": total_charging_cost + compute_carbon_cost(opt_data, PD_values),
+        "total_energy_kwh": float(load.sum()),
+        "peak_load_kw": float(load.max()) if len(load) else 0.0,
+        "num_ev_tardy": int((shortfall > tol).sum()),
+        "total_shortfall_kwh": float(shortfall[shortfall > tol].sum()),
+    }
+
+
+### Post-processing ###
+# All results are arrays aligned with the EV-hour pairs (pair_ev, pair_t), so
+# per-hour and per-EV figures are bincount/mask reductions over them.
+
+# Pyomo variable indexed by T_EV -> array in pair order
+def extract_pair_values(var):
+    return np.fromiter((v.value for v in var.values()), dtype=float, count=len(var))
+
+
+# aggregated fleet load per hour (kW)
+def hourly_load(opt_data, PD_values):
+    return np.bincount(opt_data["pair_t"], weights=PD_values, minlength=opt_data["T_max"] + 1)
+
+
 # Calculating effective aggregated charging cost
-def compute_cost_new(df_fc, PD_solution, model, time_to_idx):
-    total_cost = 0.0
-    for idx, row in df_fc.iterrows():
-        t = time_to_idx[row['timestamp']]
-        price = model.price[t]
-        
-        total_pd = sum(PD_solution.get((ev, t), 0.0) for ev in model.EV)
-        total_cost += (total_pd / 1000) * price
-        
-    return total_cost
+def compute_cost_new(opt_data, PD_values):
+    return float(hourly_load(opt_data, PD_values) / 1000 @ opt_data["price"])
 
 
-def calculate_tardiness(model):
-    tardy = []
-    for ev in model.EV:
-        t_d = int(model.departure[ev])
-        soc_dep = value(model.SOC[ev, t_d])
-        desired = value(model.SOC_desired[ev])
-        shortfall = max(0, desired - soc_dep)
-        if shortfall > 1e-3:
-            tardy.append((ev, shortfall))
+# carbon penalty on non-renewable energy, lambda_carbon per MWh
+def compute_carbon_cost(opt_data, PD_values):
+    return float(hourly_load(opt_data, PD_values) / 1000 @ (opt_data["lambda_carbon"] * (1 - opt_data["R"])))
 
-    return tardy
 
+# missing energy at departure per EV (kWh), 0 when the target is met
+def departure_shortfall(opt_data, SOC_values):
+    pair_ev = opt_data["pair_ev"]
+    at_departure = opt_data["pair_t"] == opt_data["departure"][pair_ev]
 
-def export_visualization_data(df_fc, df_ev, model, PD_solution, SOC_solution):
+    shortfall = np.zeros(len(opt_data["EV_list"]))
+    shortfall[pair_ev[at_departure]] = opt_data["SOC_desired"][pair_ev[at_departure]] - SOC_values[at_departure]
 
-    
+    return np.maximum(shortfall, 0.0)
 
 
-    df_pd = (
-        pd.DataFrame([(ev, t, PD_solution.get((ev, t), 0.0))
-                      for ev in model.EV for t in model.T],
-                     columns=["ev", "t", "PD_kW"])
-    )
-    df_pd.to_csv(f"{OPTIMIZED_DATA_DIR}/pd_solution.csv", index=False)
+def calculate_tardiness(opt_data, SOC_values, tol=1e-3):
+    shortfall = departure_shortfall(opt_data, SOC_values)
+    late = np.flatnonzero(shortfall > tol)
 
+    return list(zip(opt_data["EV_list"][late], shortfall[late].tolist()))
 
-    df_soc = (
-        pd.DataFrame([(ev, t, SOC_solution.get((ev, t), 0.0))
-                      for ev in model.EV for t in model.T],
-                     columns=["ev", "t", "SOC_kWh"])
-    )
-    df_soc.to_csv(f"{OPTIMIZED_DATA_DIR}/soc_solution.csv", index=False)
+
+# export_format:
+#   "parquet"  long format over the EV-hour pairs only (ev, t, value), EV ids
+#              as categoricals, zstd compressed
+#   "csv"      legacy dense EV x hour grid, zero outside the dwell windows
+def export_visualization_data(df_fc, df_ev, opt_data, PD_values, SOC_values, export_format="parquet"):
+
+    if export_format == "parquet":
+        ev_col = pd.Categorical.from_codes(opt_data["pair_ev"], categories=opt_data["EV_list"])
+        t_col = opt_data["pair_t"].astype(np.int32)
+
+        df_pd = pd.DataFrame({"ev": ev_col, "t": t_col, "PD_kW": PD_values})
+        df_pd.to_parquet(f"{OPTIMIZED_DATA_DIR}/pd_solution.parquet", index=False, compression="zstd")
+
+        df_soc = pd.DataFrame({"ev": ev_col, "t": t_col, "SOC_kWh": SOC_values})
+        df_soc.to_parquet(f"{OPTIMIZED_DATA_DIR}/soc_solution.parquet", index=False, compression="zstd")
+
+    elif export_format == "csv":
+        n_ev = len(opt_data["EV_list"])
+        n_hours = opt_data["T_max"] + 1
+        cell = opt_data["pair_ev"]*n_hours + opt_data["pair_t"]
+
+        PD_grid = np.zeros(n_ev*n_hours)
+        PD_grid[cell] = PD_values
+        SOC_grid = np.zeros(n_ev*n_hours)
+        SOC_grid[cell] = SOC_values
+
+        ev_col = np.repeat(opt_data["EV_list"], n_hours)
+        t_col = np.tile(np.arange(n_hours), n_ev)
+
+        df_pd = pd.DataFrame({"ev": ev_col, "t": t_col, "PD_kW": PD_grid})
+        df_pd.to_csv(f"{OPTIMIZED_DATA_DIR}/pd_solution.csv", index=False)
+
+
+        df_soc = pd.DataFrame({"ev": ev_col, "t": t_col, "SOC_kWh": SOC_grid})
+        df_soc.to_csv(f"{OPTIMIZED_DATA_DIR}/soc_solution.csv", index=False)
+
+    else:
+        raise ValueError(f"Unknown export format: {export_format}")
 
 
     df_fc_out = df_fc.copy()
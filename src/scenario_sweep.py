@@ -0,0 +1,83 @@
+from .utils import *
+from .optimization_model import prepare_optimization_data, solution_metrics, DEFAULT_MODEL_PARAMS, HIGHS_OPTIONS
+from .highs_backend import solve_with_highspy
+import pandas as pd
+import numpy as np
+import itertools
+import os
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+
+
+### Scenario sweep over model parameters ###
+# The EV/forecast data is prepared once and shipped to every worker process
+# a single time (through the pool initializer). Each scenario only overrides
+# the scalar model parameters (eta, lambda_carbon, SOC_penalty_weight, MP)
+# and is solved with the highspy backend.
+#
+# Call from under `if __name__ == "__main__":` in scripts, the process pool
+# re-imports the main module on Windows.
+
+_worker_data = None
+
+
+def run_scenario_sweep(df_ev_data, df_forecasted, param_grid, n_workers=None,
+                       start_ts="2024-12-24 00:00", end_ts="2024-12-31 00:00"):
+
+    scenarios = expand_param_grid(param_grid)
+
+    opt_data = prepare_optimization_data(df_ev_data, df_forecasted, start_ts, end_ts)
+
+    # only the numeric arrays are needed by the workers
+    shared = {k: v for k, v in opt_data.items() if k not in ("df_ev", "df_fc", "time_to_idx")}
+
+    n_workers = min(n_workers or os.cpu_count(), len(scenarios))
+
+    print(f'Running {len(scenarios)} scenarios on {n_workers} worker processes \n')
+
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(shared,)) as pool:
+        rows = list(pool.map(_solve_scenario, scenarios))
+
+    return pd.DataFrame(rows)
+
+
+# dict of lists -> cartesian product, list of dicts -> used as is
+def expand_param_grid(param_grid):
+    if isinstance(param_grid, dict):
+        keys = list(param_grid)
+        scenarios = [dict(zip(keys, values)) for values in itertools.product(*param_grid.values())]
+    else:
+        scenarios = [dict(p) for p in param_grid]
+
+    for p in scenarios:
+        unknown = set(p) - set(DEFAULT_MODEL_PARAMS)
+        if unknown:
+            raise ValueError(f"Unknown model parameters in scenario grid: {sorted(unknown)}")
+
+    return scenarios
+
+
+def _init_worker(shared):
+    global _worker_data
+    _worker_data = shared
+
+
+def _solve_scenario(scenario):
+    params = {**DEFAULT_MODEL_PARAMS, **scenario}
+
+    opt_data = dict(_worker_data)
+    opt_data["eta"] = params["eta"]
+    opt_data["lambda_carbon"] = params["lambda_carbon"]
+    opt_data["SOC_penalty_weight"] = params["SOC_penalty_weight"]
+    opt_data["MP"] = np.full(len(opt_data["EV_list"]), float(params["MP"]))
+
+    t0 = perf_counter()
+    PD_values, SOC_values, _, objective = solve_with_highspy(opt_data, HIGHS_OPTIONS)
+    solve_time = perf_counter() - t0
+
+    return {
+        **params,
+        **solution_metrics(opt_data, PD_values, SOC_values),
+        "objective": objective,
+        "solve_time_s": solve_time,
+    }
@@ -3,6 +3,7 @@
 from pathlib import Path
 import glob
 import os
+import hashlib
 
 
 ### Data Science Libraries ###
@@ -28,10 +29,47 @@ CUR_DIR = Path(__file__).resolve()
 ROOT_DIR = CUR_DIR.parent.parent
 RAW_DATA_DIR = ROOT_DIR/'data'/'raw'
 PROCESSED_DATA_DIR = ROOT_DIR/'data'/'processed'
+RAW_CACHE_DIR = PROCESSED_DATA_DIR/'raw_cache'
+FEATURE_STORE_DIR = PROCESSED_DATA_DIR/'features'
 FORECASTED_DATA_DIR = ROOT_DIR/'data'/'forecasted'
+FORECAST_MODEL_DIR = FORECASTED_DATA_DIR/'models'
 EV_DATA_DIR = ROOT_DIR/'data'/'ev'
+EV_CACHE_DIR = EV_DATA_DIR/'cache'
 OPTIMIZED_DATA_DIR = ROOT_DIR/'data'/'optimized'
 
+# bidding zone time zone (BZN|NL)
+MARKET_TZ = 'Europe/Amsterdam'
+
+
+### Time helpers ###
+# The pipeline keys hours by tz-aware timestamps in MARKET_TZ. Hour flooring is
+# done on the UTC nanoseconds, wall-clock flooring is ambiguous in the repeated
+# autumn hour (the zone's offsets are whole hours, so both agree otherwise).
+# Integer views are always taken at ns resolution: parquet/Arrow round-trips
+# can return s/ms/us timestamps.
+
+def floor_to_hour(values):
+    stamps = pd.DatetimeIndex(values)
+    floored = stamps.as_unit('ns').asi8 // 3_600_000_000_000 * 3_600_000_000_000
+    if stamps.tz is None:
+        return pd.DatetimeIndex(floored.view('datetime64[ns]'))
+    return pd.DatetimeIndex(floored, tz='UTC').tz_convert(stamps.tz)
+
+
+# user supplied bounds such as "2024-12-24 00:00" in the time zone of a timeline
+def as_timeline_time(ts, tz):
+    ts = pd.Timestamp(ts)
+    if tz is None:
+        return ts.tz_convert(None) if ts.tzinfo is not None else ts
+    return ts.tz_localize(tz) if ts.tzinfo is None else ts.tz_convert(tz)
+
+
+### File helpers ###
+
+# content hash of a file, for cache invalidation (raw files, EV templates)
+def file_sha1(path):
+    return hashlib.sha1(Path(path).read_bytes()).hexdigest()
+
 '''
 print(CUR_DIR)
 print(ROOT_DIR)
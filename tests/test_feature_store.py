@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.feature_store import create_features, ex_post_columns, GATE_CLOSURE_HOUR
+
+
+# two weeks around the autumn DST switch (25 hour day on 2024-10-27) and the
+# spring one (23 hour day on 2024-03-31)
+def market_data(start):
+    index = pd.date_range(start, periods=14*24, freq='h', tz='Europe/Amsterdam')
+    rng = np.random.default_rng(0)
+    columns = ['DA_Price', 'forecast_load', 'actual_load', 'solar_generation', 'wind_on_generation']
+
+    return pd.DataFrame(rng.normal(100, 20, (len(index), len(columns))), index=index, columns=columns)
+
+
+def day_ahead_inputs(df):
+    features = create_features(df, day_ahead=True)
+    return features.drop(['DA_Price', 'date'] + ex_post_columns(features), axis=1)
+
+
+@pytest.mark.parametrize('start', ['2024-10-20', '2024-03-24'])
+def test_actuals_after_gate_closure_do_not_reach_the_delivery_day(start):
+    df = market_data(start)
+    inputs = day_ahead_inputs(df)
+
+    for day in df.index.normalize().unique()[1:]:
+        gate_closure = (day.tz_localize(None) - pd.Timedelta(days=1, hours=-GATE_CLOSURE_HOUR)).tz_localize(day.tz)
+        perturbed = df.copy()
+        perturbed.loc[perturbed.index >= gate_closure, ex_post_columns(df)] += 1000
+
+        delivery = inputs.index.normalize() == day
+        pd.testing.assert_frame_equal(day_ahead_inputs(perturbed)[delivery], inputs[delivery])
+
+
+def test_actuals_before_gate_closure_are_used():
+    df = market_data('2024-10-20')
+    perturbed = df.copy()
+    perturbed.loc[perturbed.index.hour < GATE_CLOSURE_HOUR, 'solar_generation'] += 1000
+
+    delivery = df.index.normalize() == df.index.normalize().unique()[3]
+    assert not day_ahead_inputs(perturbed)[delivery].equals(day_ahead_inputs(df)[delivery])